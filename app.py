@@ -1,51 +1,65 @@
 import os
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from flask_sqlalchemy import SQLAlchemy
+import io
+import hashlib
+import zipfile
+from flask import Blueprint, Flask, current_app, render_template, request, jsonify, session, redirect, url_for, flash
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField
 from wtforms.validators import DataRequired, Email, EqualTo, Length
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
+from models import db, User, database_uri, engine_options
 from services.ai_handler import CosmosAIHandler
+from services.assets import init_assets
+from services.compression import cacheable, init_compression
+from services.identity_cache import user_cache
 from services.iss_service import ISSService
-from services.utils import compress_image
+from services.job_queue import JobQueue, QueueFull
+from services.metrics import init_metrics
+from services.page_cache import data_version, init_page_cache, prerender_pages, render_page
+from services.passwords import HashingBusy, login_throttle
+from services.registry import ServiceRegistry
+from services.uploads import MAX_UPLOAD_BYTES, SpooledRequest, UploadError, inspect_upload
+from services.utils import compress_image, compress_images, iter_zip_images
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.getenv("SECRET_KEY", "cosmos_ai_super_secret_key_2026")
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
 login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'info'
 
-# Initialize Services
-ai_handler = CosmosAIHandler()
-iss_service = ISSService()
+main = Blueprint('main', __name__)
+
+def _registry():
+    return current_app.extensions['cosmos_services']
 
-# User Model
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(150), unique=True, nullable=False)
-    email = db.Column(db.String(150), unique=True, nullable=False)
-    password_hash = db.Column(db.String(256), nullable=False)
+# Per-worker services: built on first use inside each worker, never in the
+# gunicorn master, so sockets, threads and SDK clients are not shared
+# across fork.
+def get_ai_handler():
+    app = current_app._get_current_object()
+    return _registry().get('ai_handler', lambda: CosmosAIHandler(flight_db=os.path.join(app.instance_path, 'flights.db')))
 
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+def get_iss_service():
+    return _registry().get('iss_service', ISSService)
 
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+def get_job_queue():
+    app = current_app._get_current_object()
+    return _registry().get('job_queue', lambda: JobQueue(os.path.join(app.instance_path, 'jobs.db')))
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Most authenticated requests are answered from the identity cache
+    user_id = int(user_id)
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    user = db.session.get(User, user_id)
+    return user_cache.put(user) if user else None
 
 def api_login_required(f):
     @wraps(f)
@@ -55,9 +69,11 @@ def api_login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# Create database
-with app.app_context():
-    db.create_all()
+# Create database: once per process on the first request (or via
+# `flask --app app init-db`), never at import time
+@main.before_app_request
+def ensure_schema():
+    _registry().get('schema', lambda: db.create_all() or True)
 
 # Forms
 class LoginForm(FlaskForm):
@@ -75,111 +91,152 @@ class RegistrationForm(FlaskForm):
 
 # --- Authentication Routes ---
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
-        if user is None or not user.check_password(form.password.data):
-            flash('Invalid username or password', 'error')
-            return redirect(url_for('login'))
-
+        username, ip = form.username.data, request.remote_addr or 'unknown'
+        # Refuse throttled usernames/IPs before spending any hash work
+        wait = login_throttle.retry_after(username, ip)
+        if wait:
+            flash(f'Too many failed attempts. Try again in {int(wait // 60) + 1} minute(s).', 'error')
+            return redirect(url_for('main.login'))
+
+        try:
+            user = User.find_by_username(username)
+            if user is None or not user.check_password(form.password.data):
+                login_throttle.record_failure(username, ip)
+                flash('Invalid username or password', 'error')
+                return redirect(url_for('main.login'))
+
+            # Upgrade hashes made with older cost settings while we have the password
+            if user.password_needs_rehash():
+                user.set_password(form.password.data)
+                db.session.commit()
+        except HashingBusy:
+            flash('Server is busy, please try again in a moment.', 'error')
+            return render_template('login.html', title='Sign In', form=form), 503
+
+        login_throttle.reset(username)
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or not next_page.startswith('/'):
-            next_page = url_for('home')
+            next_page = url_for('main.home')
         return redirect(next_page)
 
     return render_template('login.html', title='Sign In', form=form)
 
-@app.route('/register', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     form = RegistrationForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
+        user = User.find_by_username(form.username.data)
         if user is not None:
             flash('Username already exists', 'error')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
-        user = User.query.filter_by(email=form.email.data).first()
+        user = User.find_by_email(form.email.data)
         if user is not None:
             flash('Email already registered', 'error')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         user = User(username=form.username.data, email=form.email.data)
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except HashingBusy:
+            flash('Server is busy, please try again in a moment.', 'error')
+            return render_template('register.html', title='Sign Up', form=form), 503
         db.session.add(user)
         db.session.commit()
 
         flash('Congratulations, you are now a registered user!', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     return render_template('register.html', title='Sign Up', form=form)
 
-@app.route('/logout')
+@main.route('/logout')
 def logout():
     logout_user()
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
-@app.route('/test')
+@main.route('/test')
 def test():
     return f"User authenticated: {current_user.is_authenticated}, User: {current_user.username if current_user.is_authenticated else 'None'}"
 
-@app.route('/protected')
+@main.route('/protected')
 @login_required
 def protected():
     return f"Hello {current_user.username}! This is a protected page."
 
 # --- Page Routes ---
 
-@app.route('/')
+# Shown until the user refreshes events
+DEFAULT_EVENTS = [
+    {"date": "Jan 10, 2026", "event": "Jupiter Opposition", "desc": "Jupiter closest to Earth."},
+    {"date": "Feb 28, 2026", "event": "Planet Parade", "desc": "Alignment of 6 planets."},
+    {"date": "Mar 3, 2026", "event": "Blood Moon", "desc": "Total Lunar Eclipse."}
+]
+
+@main.route('/')
 @login_required
 def home():
     # Pass hardcoded events initially, or use session cache
-    events = session.get('cached_events', [
-        {"date": "Jan 10, 2026", "event": "Jupiter Opposition", "desc": "Jupiter closest to Earth."},
-        {"date": "Feb 28, 2026", "event": "Planet Parade", "desc": "Alignment of 6 planets."},
-        {"date": "Mar 3, 2026", "event": "Blood Moon", "desc": "Total Lunar Eclipse."}
-    ])
-    return render_template('home.html', events=events)
-
-@app.route('/iss')
+    events = session.get('cached_events', DEFAULT_EVENTS)
+    # The timeline fragment is cached per distinct events list
+    return render_template('home.html', events=events, events_version=data_version(events))
+
+@main.route('/iss')
 @login_required
 def iss_page():
-    return render_template('iss.html')
+    return render_page('iss.html')
 
-@app.route('/vision')
+@main.route('/vision')
 @login_required
 def vision_page():
-    return render_template('vision.html')
+    return render_page('vision.html')
 
-@app.route('/chat')
+@main.route('/chat')
 @login_required
 def chat_page():
-    return render_template('chat.html')
+    return render_page('chat.html')
 
-@app.route('/counselor')
+@main.route('/counselor')
 @login_required
 def counselor_page():
-    return render_template('counselor.html')
+    return render_page('counselor.html')
+
+# Pages served by render_page, prerendered at startup
+STATIC_PAGES = {
+    'main.iss_page': 'iss.html',
+    'main.vision_page': 'vision.html',
+    'main.chat_page': 'chat.html',
+    'main.counselor_page': 'counselor.html',
+}
 
 # --- API Routes ---
 
-@app.route('/api/iss', methods=['GET'])
+@main.route('/api/events', methods=['GET'])
+@api_login_required
+@cacheable
+def events_api():
+    return jsonify({"events": session.get('cached_events', DEFAULT_EVENTS)})
+
+@main.route('/api/iss', methods=['GET'])
 @api_login_required
+@cacheable
 def get_iss_status():
     city = request.args.get('city')
     if not city:
         return jsonify({"error": "City parameter is required"}), 400
-    return jsonify(iss_service.check_visibility(city))
+    return jsonify(get_iss_service().check_visibility(city))
 
-@app.route('/api/analyze', methods=['POST'])
+@main.route('/api/analyze', methods=['POST'])
 @api_login_required
 def analyze_sky():
     if 'image' not in request.files:
@@ -187,14 +244,120 @@ def analyze_sky():
     file = request.files['image']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
+
+    # Reject bad formats and decompression bombs from the header alone
+    try:
+        inspect_upload(file)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
     
+    # Job mode: hand the work to the queue and return a job id right away
+    if request.values.get('mode') == 'async':
+        image_bytes = file.read()
+        key = "analyze:" + hashlib.sha256(image_bytes).hexdigest()
+        return _queue_job(key, _analyze_job, get_ai_handler(), image_bytes)
+
     img_b64 = compress_image(file)
     if not img_b64:
         return jsonify({"error": "Image Error"}), 500
         
-    return jsonify(ai_handler.analyze_image(img_b64))
+    return jsonify(get_ai_handler().analyze_image(img_b64))
+
+def _queue_job(key, fn, *args):
+    """Submit fn(*args) to the job queue; 202 with a poll URL, or 503 when full."""
+    try:
+        job_id = get_job_queue().submit(key, fn, *args)
+    except QueueFull:
+        return jsonify({"error": "Server is busy, please try again in a moment"}), 503
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "poll_url": url_for('main.job_status', job_id=job_id)
+    }), 202
+
+def _analyze_job(ai_handler, image_bytes):
+    """Background version of analyze_sky (runs in the job pool, outside app context)."""
+    img_b64 = compress_image(io.BytesIO(image_bytes))
+    if not img_b64:
+        return {"error": "Image Error"}
+    return ai_handler.analyze_image(img_b64)
+
+# Frames accepted per batch upload
+BATCH_MAX_FRAMES = int(os.getenv("BATCH_MAX_FRAMES", "48"))
 
-@app.route('/api/chat', methods=['POST'])
+@main.route('/api/analyze/batch', methods=['POST'])
+@api_login_required
+def analyze_batch():
+    # Frames come either as repeated 'images' fields or as one 'archive' zip
+    uploads = [(f.filename, f) for f in request.files.getlist('images') if f.filename]
+    archive = request.files.get('archive')
+    if len(uploads) > BATCH_MAX_FRAMES:
+        return jsonify({"error": f"Too many frames (max {BATCH_MAX_FRAMES})"}), 400
+    try:
+        if archive and archive.filename:
+            # Counted from the zip's directory before any member is inflated;
+            # the separately uploaded images use up part of the limit
+            remaining = BATCH_MAX_FRAMES - len(uploads)
+            uploads.extend(iter_zip_images(archive, max_members=remaining))
+
+        if not uploads:
+            return jsonify({"error": "No images uploaded"}), 400
+
+        for name, f in uploads:
+            try:
+                inspect_upload(f)
+            except UploadError as e:
+                raise UploadError(f"{name}: {e}", e.status)
+    except zipfile.BadZipFile:
+        return jsonify({"error": "Invalid zip archive"}), 400
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    names = [name for name, _ in uploads]
+    frames = [f for _, f in uploads]
+
+    if request.values.get('mode') == 'async':
+        # The job outlives the request's spooled files; zip members are
+        # already in memory and are passed through as they are
+        frames = [f if isinstance(f, io.BytesIO) else io.BytesIO(f.read()) for f in frames]
+        digest = hashlib.sha256()
+        for frame in frames:
+            with frame.getbuffer() as data:
+                digest.update(hashlib.sha256(data).digest())
+        return _queue_job("batch:" + digest.hexdigest(), _analyze_batch_job, get_ai_handler(), names, frames)
+
+    return jsonify(_analyze_batch_job(get_ai_handler(), names, frames))
+
+def _analyze_batch_job(ai_handler, names, frames):
+    """Preprocess frames (file objects) in parallel, then analyze the whole session."""
+    compressed = compress_images(frames)
+    frames = [(name, b64) for name, b64 in zip(names, compressed) if b64]
+    failed = [name for name, b64 in zip(names, compressed) if not b64]
+    if not frames:
+        return {"error": "Image Error"}
+
+    result = ai_handler.analyze_images(frames)
+    if failed:
+        result["failed"] = failed
+    return result
+
+# Longest a job poll may block a serving thread
+JOB_POLL_MAX_WAIT = float(os.getenv("JOB_POLL_MAX_WAIT", "2"))
+
+@main.route('/api/jobs/<job_id>', methods=['GET'])
+@api_login_required
+@cacheable
+def job_status(job_id):
+    # ?wait=N holds the request up to N seconds (capped at JOB_POLL_MAX_WAIT
+    # so pollers cannot tie up serving threads); clients poll with backoff
+    wait = min(request.args.get('wait', 0, type=float), JOB_POLL_MAX_WAIT)
+    queue = get_job_queue()
+    job = queue.wait(job_id, wait) if wait > 0 else queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job)
+
+@main.route('/api/chat', methods=['POST'])
 @api_login_required
 def chat_api():
     data = request.json
@@ -204,7 +367,7 @@ def chat_api():
     history = session.get('chat_history', [])
     # Convert session history to Gemini format if possible, or just pass list
     # Handler now expects list
-    response_text = ai_handler.get_chatbot_response(user_message, history)
+    response_text = get_ai_handler().get_chatbot_response(user_message, history)
     
     # Simple history management
     history.append({"role": "user", "parts": [user_message]})
@@ -213,29 +376,85 @@ def chat_api():
     
     return jsonify({"response": response_text})
 
-@app.route('/api/dark-sky', methods=['POST'])
+@main.route('/api/dark-sky', methods=['POST'])
 @api_login_required
 def dark_sky_api():
     data = request.json
     city = data.get('city', '')
-    result = ai_handler.suggest_dark_sky(city)
+    result = get_ai_handler().suggest_dark_sky(city)
     return jsonify(result)
 
-@app.route('/api/refresh-events', methods=['POST'])
+@main.route('/api/refresh-events', methods=['POST'])
 @api_login_required
 def refresh_events():
     # Only allow refresh every few mins in real app, here we just call
-    new_events = ai_handler.get_fresh_events()
+    new_events = get_ai_handler().get_fresh_events()
     if new_events:
         session['cached_events'] = new_events
         return jsonify({"status": "updated", "events": new_events})
     return jsonify({"status": "failed"}), 500
 
-@app.route('/reset-chat', methods=['POST'])
+@main.app_errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    limit_mb = current_app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024)
+    return jsonify({"error": f"Upload too large (max {limit_mb:g} MB)"}), 413
+
+@main.route('/reset-chat', methods=['POST'])
 @api_login_required
 def reset_chat():
     session.pop('chat_history', None)
     return jsonify({"status": "cleared"})
 
+# Proxies in front of the app (Vercel, a load balancer) whose
+# X-Forwarded-For/-Proto are trusted; 0 when clients connect directly
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+def create_app(config=None):
+    """Build the Flask app. config: optional dict of overrides (tests, scripts)."""
+    app = Flask(__name__)
+    app.request_class = SpooledRequest
+    if TRUSTED_PROXY_HOPS:
+        # remote_addr is the real client, so the login throttle's IP limit
+        # does not lump every user together as the proxy's address
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+    app.secret_key = os.getenv("SECRET_KEY", "cosmos_ai_super_secret_key_2026")
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(config or {})
+    # Pool options follow the URI actually in use, overrides included
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.extensions['cosmos_services'] = ServiceRegistry()
+    app.register_blueprint(main)
+    init_assets(app)
+    init_compression(app)
+    init_page_cache(app)
+    init_metrics(app)
+
+    @app.cli.command('init-db')
+    def init_db():
+        """Create the database tables."""
+        db.create_all()
+        print("Database initialised.")
+
+    warm_up(app)
+    return app
+
+def warm_up(app):
+    """Load read-only data up front (in the gunicorn master when preloading).
+
+    Compiled templates and prerendered pages then live in memory the
+    workers share copy-on-write instead of each worker building them on
+    its first request.
+    """
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    prerender_pages(app, STATIC_PAGES)
+
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True)
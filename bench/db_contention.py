@@ -0,0 +1,93 @@
+"""
+DB contention benchmark - login/registration throughput vs worker count
+Each worker process builds its own app (as gunicorn workers do) against a
+shared scratch database and runs a login-like mix: username lookups plus a
+fraction of registrations (writes). Password hashing is left out so the
+numbers reflect the database layer only.
+
+Usage: python bench/db_contention.py [--workers 1,2,4,8] [--seconds 5] [--write-ratio 0.1]
+       DATABASE_URL=postgresql://... python bench/db_contention.py
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SEED_USERS = 500
+
+
+def _app(uri):
+    from app import create_app
+    return create_app({"SQLALCHEMY_DATABASE_URI": uri})
+
+
+def seed(uri):
+    from models import db, User
+    app = _app(uri)
+    with app.app_context():
+        db.create_all()
+        for i in range(SEED_USERS):
+            db.session.add(User(username=f"user{i}", email=f"user{i}@example.com", password_hash="x"))
+        db.session.commit()
+
+
+def worker(args):
+    uri, seconds, write_ratio = args
+    from models import db, User
+    app = _app(uri)
+    reads = writes = errors = 0
+    deadline = time.monotonic() + seconds
+    with app.app_context():
+        while time.monotonic() < deadline:
+            try:
+                if random.random() < write_ratio:
+                    name = uuid.uuid4().hex[:12]
+                    db.session.add(User(username=name, email=f"{name}@example.com", password_hash="x"))
+                    db.session.commit()
+                    writes += 1
+                else:
+                    User.find_by_username(f"user{random.randrange(SEED_USERS)}")
+                    db.session.rollback()  # end the read transaction like a request would
+                    reads += 1
+            except Exception:
+                db.session.rollback()
+                errors += 1
+    return reads, writes, errors
+
+
+def run(workers, seconds, write_ratio, uri):
+    with Pool(workers) as pool:
+        results = pool.map(worker, [(uri, seconds, write_ratio)] * workers)
+    reads, writes, errors = (sum(column) for column in zip(*results))
+    return reads / seconds, writes / seconds, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    scratch = None
+    uri = os.getenv("DATABASE_URL")
+    if not uri:
+        scratch = tempfile.mkdtemp(prefix="cosmos_bench_")
+        uri = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    seed(uri)
+
+    print(f"--- DB CONTENTION ({uri.split(':')[0]}, {args.write_ratio:.0%} writes) ---")
+    print(f"{'workers':>8} {'reads/s':>10} {'writes/s':>10} {'errors':>8}")
+    for count in (int(w) for w in args.workers.split(",")):
+        reads, writes, errors = run(count, args.seconds, args.write_ratio, uri)
+        print(f"{count:>8} {reads:>10.0f} {writes:>10.0f} {errors:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""
+Load test - end-to-end throughput and latency against stubbed upstreams
+Starts bench/stubs.py and, per scenario, a fresh gunicorn (gunicorn.conf.py)
+wired to the stubs with fake API keys and a scratch database. It logs in,
+drives /api/iss, /api/chat, /api/analyze and /api/dark-sky at a set
+concurrency, and reports per endpoint: requests/s, error count and
+p50/p95/p99 latency, plus peak RSS of the gunicorn processes and the calls
+each upstream saw. Each scenario gets a fresh app, so provider state such
+as exhausted keys starts clean.
+
+--save writes the results as a baseline; --compare checks a run against
+one and exits non-zero on a regression (p95 or throughput worse than the
+tolerance), so it can gate a deploy. Compare only against baselines from
+the same machine.
+
+Usage: python bench/loadtest.py [--scenarios baseline,key-exhaustion]
+           [--concurrency 8] [--seconds 20] [--workers 2]
+           [--save bench/baseline.json] [--compare bench/baseline.json]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stubs import DEFAULTS, UPSTREAMS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KEYS_PER_PROVIDER = 5
+
+# upstream knobs (see bench/stubs.py) and app environment per scenario
+SCENARIOS = {
+    "baseline": {
+        "description": "All upstreams healthy, 50ms latency",
+        "stubs": {},
+    },
+    "slow-upstreams": {
+        "description": "Every upstream at 800ms, AI answers stream at 5ms/token",
+        "stubs": {
+            "iss": {"latency_ms": 800},
+            "nominatim": {"latency_ms": 800},
+            "gemini": {"latency_ms": 800, "per_token_ms": 5},
+            "openai": {"latency_ms": 800, "per_token_ms": 5},
+        },
+    },
+    "flaky-upstreams": {
+        "description": "20% HTTP 500 from every upstream",
+        "stubs": {name: {"error_rate": 0.2} for name in ("iss", "nominatim", "gemini", "openai")},
+    },
+    "gemini-outage": {
+        "description": "Gemini always fails; breaker should route to OpenAI",
+        "stubs": {"gemini": {"error_rate": 1.0}},
+    },
+    "key-exhaustion": {
+        "description": "Every Gemini key over quota; all traffic rotates to OpenAI",
+        "stubs": {"gemini": {"exhausted_keys": [f"stub-gemini-{i}" for i in range(1, KEYS_PER_PROVIDER + 1)]}},
+    },
+    "rotation-storm": {
+        "description": "30% HTTP 429 from both providers; keys rotate until local mode",
+        "stubs": {"gemini": {"rate_limit_rate": 0.3}, "openai": {"rate_limit_rate": 0.3}},
+    },
+    "local-only": {
+        "description": "No API keys configured; local fallbacks only",
+        "stubs": {},
+        "keys": 0,
+    },
+}
+
+# Relative share of each endpoint in the request mix
+MIX = {"iss": 3, "chat": 3, "dark_sky": 2, "analyze": 2}
+
+CITIES = ("Delhi", "London", "New York", "Tokyo", "Sydney")
+QUESTIONS = (
+    "What is a black hole?",
+    "When is the next meteor shower?",
+    "How far away is the Andromeda galaxy?",
+    "Why is Mars red?",
+    "What can I see in the sky tonight?",
+    "How do I find the North Star?",
+    "What is a nebula?",
+    "How big is Jupiter?",
+)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _sky_image():
+    """A dark JPEG with a few hundred stars, the same on every run."""
+    from PIL import Image, ImageDraw
+    rng = random.Random(42)
+    img = Image.new("RGB", (1600, 1200), (8, 10, 20))
+    draw = ImageDraw.Draw(img)
+    for _ in range(400):
+        x, y, r = rng.randrange(1600), rng.randrange(1200), rng.choice((1, 1, 2, 3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(255, 255, 240))
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+# --- processes ---
+
+def start_stubs():
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "bench", "stubs.py"), "--port", "0"],
+        stdout=subprocess.PIPE, text=True,
+    )
+    line = process.stdout.readline()
+    match = re.search(r"http://[\d.]+:(\d+)", line)
+    if not match:
+        process.kill()
+        raise RuntimeError(f"Stub server did not start: {line!r}")
+    return process, f"http://127.0.0.1:{match.group(1)}"
+
+
+def app_env(stub_url, scratch, keys):
+    env = dict(os.environ)
+    host = stub_url.split("://", 1)[1]
+    env.update({
+        "ISS_API_URL": f"{stub_url}/iss-now.json",
+        "NOMINATIM_DOMAIN": host,
+        "NOMINATIM_SCHEME": "http",
+        "GEMINI_API_ENDPOINT": stub_url,
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(scratch, 'users.db')}",
+        "SECRET_KEY": "bench-secret",
+        # Login bursts are the point here, not brute-force protection
+        "LOGIN_MAX_FAILURES_IP": "1000000",
+    })
+    # Set every key variable explicitly so real keys from .env never leak in
+    for base, prefix in (("GEMINI_AI_KEY", "stub-gemini"), ("OPEN_AI_KEY", "stub-openai")):
+        for i in range(1, 11):
+            name = base if i == 1 else f"{base}_{i}"
+            env[name] = f"{prefix}-{i}" if i <= keys else ""
+    return env
+
+
+def start_app(env, workers, port):
+    env = dict(env, WEB_CONCURRENCY=str(workers), GUNICORN_BIND=f"127.0.0.1:{port}")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited during start-up")
+        try:
+            requests.get(f"{base}/login", timeout=1)
+            return process, base
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("gunicorn did not start within 60s")
+
+
+def stop(process):
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _rss_tree(pid):
+    """Summed RSS (bytes) of pid and its children; shared pages count once per process."""
+    pids = {pid}
+    try:
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.add(int(entry))
+        total = 0
+        for p in pids:
+            with open(f"/proc/{p}/status") as f:
+                match = re.search(r"VmRSS:\s+(\d+) kB", f.read())
+                total += int(match.group(1)) * 1024 if match else 0
+        return total
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            rss = _rss_tree(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+# --- load ---
+
+def _csrf(html):
+    match = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', html)
+    return match.group(1) if match else ""
+
+
+def login(base):
+    """Register the bench user and return its session cookies."""
+    session = requests.Session()
+    form = {"username": "benchuser", "email": "bench@example.com", "password": "bench-password",
+            "password2": "bench-password"}
+    page = session.get(f"{base}/register")
+    session.post(f"{base}/register", data=dict(form, csrf_token=_csrf(page.text)))
+    page = session.get(f"{base}/login")
+    response = session.post(f"{base}/login", data=dict(form, csrf_token=_csrf(page.text)))
+    if "session" not in session.cookies or "/login" in response.url:
+        raise RuntimeError("Could not log in the bench user")
+    return session.cookies
+
+
+def _request(session, base, endpoint, image):
+    if endpoint == "iss":
+        return session.get(f"{base}/api/iss", params={"city": random.choice(CITIES)})
+    if endpoint == "chat":
+        return session.post(f"{base}/api/chat", json={"message": random.choice(QUESTIONS)})
+    if endpoint == "dark_sky":
+        return session.post(f"{base}/api/dark-sky", json={"city": random.choice(CITIES)})
+    return session.post(f"{base}/api/analyze", files={"image": ("sky.jpg", image, "image/jpeg")})
+
+
+def drive(base, cookies, concurrency, seconds, image):
+    """Run the request mix; return {endpoint: (latencies, errors)} and elapsed seconds."""
+    latencies = defaultdict(list)
+    errors = Counter()
+    lock = threading.Lock()
+    endpoints = [name for name, weight in MIX.items() for _ in range(weight)]
+    deadline = time.monotonic() + seconds
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        session.cookies.update(cookies)
+        while time.monotonic() < deadline:
+            endpoint = rng.choice(endpoints)
+            started = time.perf_counter()
+            try:
+                ok = _request(session, base, endpoint, image).status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies[endpoint].append(elapsed)
+                if not ok:
+                    errors[endpoint] += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    return latencies, errors, time.monotonic() - started
+
+
+def summarise(latencies, errors, elapsed):
+    summary = {}
+    for endpoint in list(MIX) + ["all"]:
+        if endpoint == "all":
+            values = sorted(v for series in latencies.values() for v in series)
+            failed = sum(errors.values())
+        else:
+            values = sorted(latencies.get(endpoint, ()))
+            failed = errors.get(endpoint, 0)
+        if not values:
+            continue
+        summary[endpoint] = {
+            "requests": len(values),
+            "errors": failed,
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(_percentile(values, 50) * 1000, 1),
+            "p95_ms": round(_percentile(values, 95) * 1000, 1),
+            "p99_ms": round(_percentile(values, 99) * 1000, 1),
+        }
+    return summary
+
+
+def run_scenario(name, scenario, stub_url, args, image):
+    requests.post(f"{stub_url}/_stub/config", json=_stub_config(scenario["stubs"]))
+    scratch = tempfile.mkdtemp(prefix="cosmos_load_")
+    env = app_env(stub_url, scratch, scenario.get("keys", KEYS_PER_PROVIDER))
+    app, base = start_app(env, args.workers, _free_port())
+    sampler = RssSampler(app.pid)
+    sampler.start()
+    try:
+        cookies = login(base)
+        # One untimed pass per endpoint so lazy set-up is not measured
+        session = requests.Session()
+        session.cookies.update(cookies)
+        for endpoint in MIX:
+            _request(session, base, endpoint, image)
+        requests.post(f"{stub_url}/_stub/reset")
+        latencies, errors, elapsed = drive(base, cookies, args.concurrency, args.seconds, image)
+        upstream = requests.get(f"{stub_url}/_stub/stats").json()
+    finally:
+        sampler.stop()
+        stop(app)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {
+        "endpoints": summarise(latencies, errors, elapsed),
+        "peak_rss_mb": round(sampler.peak / 2**20, 1) if sampler.peak else None,
+        "upstream_calls": upstream,
+    }
+
+
+def _stub_config(overrides):
+    config = {name: dict(DEFAULTS) for name in UPSTREAMS}
+    for name, knobs in overrides.items():
+        config[name].update(knobs)
+    return config
+
+
+# --- reporting ---
+
+def report(name, result):
+    print(f"\n=== {name}: {SCENARIOS[name]['description']} ===")
+    print(f"{'endpoint':>10} {'reqs':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, row in result["endpoints"].items():
+        print(f"{endpoint:>10} {row['requests']:>6} {row['errors']:>6} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f}")
+    print(f"peak RSS: {result['peak_rss_mb']} MB")
+    calls = ", ".join(f"{key}={count}" for key, count in sorted(result["upstream_calls"].items()))
+    print(f"upstream calls: {calls or 'none'}")
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against baseline, as printable lines."""
+    problems = []
+    for name, result in results.items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        for endpoint, row in result["endpoints"].items():
+            before = previous["endpoints"].get(endpoint)
+            if not before:
+                continue
+            if row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                problems.append(f"{name}/{endpoint}: p95 {before['p95_ms']}ms -> {row['p95_ms']}ms")
+            if row["rps"] < before["rps"] * (1 - tolerance):
+                problems.append(f"{name}/{endpoint}: throughput {before['rps']} -> {row['rps']} req/s")
+            if row["errors"] / row["requests"] > before["errors"] / before["requests"] + tolerance / 10:
+                problems.append(f"{name}/{endpoint}: errors {before['errors']}/{before['requests']} "
+                                f"-> {row['errors']}/{row['requests']}")
+        if previous.get("peak_rss_mb") and result.get("peak_rss_mb"):
+            if result["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance):
+                problems.append(f"{name}: peak RSS {previous['peak_rss_mb']} -> {result['peak_rss_mb']} MB")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--save", metavar="PATH", help="write results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="fail on regressions against a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    image = _sky_image()
+    stubs, stub_url = start_stubs()
+    results = {}
+    try:
+        for name in names:
+            results[name] = run_scenario(name, SCENARIOS[name], stub_url, args, image)
+            report(name, results[name])
+    finally:
+        stop(stubs)
+
+    run = {
+        "settings": {"concurrency": args.concurrency, "seconds": args.seconds, "workers": args.workers},
+        "scenarios": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != run["settings"]:
+            print("\nWarning: baseline was recorded with different settings")
+        problems = compare(results, baseline, args.tolerance)
+        if problems:
+            print(f"\nREGRESSIONS (tolerance {args.tolerance:.0%}):")
+            for line in problems:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Upstream stubs - local stand-ins for open-notify, Nominatim, Gemini and OpenAI
+One threaded HTTP server answers in each upstream's wire format:
+    GET  /iss-now.json                           open-notify
+    GET  /search?q=...                           Nominatim
+    POST /v1beta/models/<model>:generateContent  Gemini (REST transport)
+    POST /v1/chat/completions                    OpenAI
+Every upstream has its own knobs: latency_ms (+ jitter_ms), error_rate
+(HTTP 500), rate_limit_rate (HTTP 429), exhausted_keys (always 429 for
+those API keys), and for the AI stubs answer_tokens / per_token_ms, so
+generation time grows with the answer length (capped by the request's
+max token setting) like a real model.
+
+Knobs are changed at runtime with POST /_stub/config {"gemini": {...}};
+GET /_stub/stats returns request counts per upstream and status, and
+POST /_stub/reset clears them.
+
+Point the app at it with:
+    ISS_API_URL=http://127.0.0.1:8787/iss-now.json
+    NOMINATIM_DOMAIN=127.0.0.1:8787 NOMINATIM_SCHEME=http
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8787
+    OPENAI_BASE_URL=http://127.0.0.1:8787/v1
+
+Usage: python bench/stubs.py [--port 8787] [--latency-ms 50]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+UPSTREAMS = ("iss", "nominatim", "gemini", "openai")
+
+DEFAULTS = {
+    "latency_ms": 50,
+    "jitter_ms": 10,
+    "error_rate": 0.0,
+    "rate_limit_rate": 0.0,
+    "exhausted_keys": [],
+    "answer_tokens": 300,
+    "per_token_ms": 0.0,
+}
+
+CITIES = {
+    "delhi": (28.6139, 77.2090),
+    "london": (51.5074, -0.1278),
+    "new york": (40.7128, -74.0060),
+    "tokyo": (35.6762, 139.6503),
+    "sydney": (-33.8688, 151.2093),
+}
+
+WORDS = ("orion", "nebula", "bright", "visible", "east", "tonight", "the", "sky", "is", "clear")
+
+_config = {name: dict(DEFAULTS) for name in UPSTREAMS}
+_stats = Counter()
+_lock = threading.Lock()
+
+
+def configure(updates):
+    with _lock:
+        for name, knobs in updates.items():
+            if name not in _config:
+                raise KeyError(name)
+            _config[name].update(knobs)
+
+
+def _answer(tokens):
+    text = " ".join(random.choice(WORDS) for _ in range(tokens))
+    return f"## Stub answer\n\n{text}\n"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- plumbing ---
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _api_key(self, query):
+        auth = self.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            return auth[len("Bearer "):]
+        return self.headers.get("x-goog-api-key") or query.get("key", [None])[0]
+
+    def _fail(self, upstream, knobs, key):
+        """Apply the failure knobs; return the status sent, or None to proceed."""
+        if key in knobs["exhausted_keys"] or random.random() < knobs["rate_limit_rate"]:
+            status = 429
+        elif random.random() < knobs["error_rate"]:
+            status = 500
+        else:
+            return None
+        if upstream == "gemini" and status == 429:
+            body = {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).",
+                              "status": "RESOURCE_EXHAUSTED"}}
+        elif status == 429:
+            body = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+        else:
+            body = {"error": {"code": 500, "message": "Internal error (stub)", "status": "INTERNAL"}}
+        self._send(status, body)
+        return status
+
+    def _handle(self, upstream, respond, query=None):
+        with _lock:
+            knobs = dict(_config[upstream])
+        delay = knobs["latency_ms"] + random.uniform(-knobs["jitter_ms"], knobs["jitter_ms"])
+        time.sleep(max(delay, 0) / 1000)
+        status = self._fail(upstream, knobs, self._api_key(query or {}))
+        if status is None:
+            status = respond(knobs)
+        with _lock:
+            _stats[f"{upstream}:{status}"] += 1
+
+    def _generate(self, knobs, max_tokens):
+        tokens = min(knobs["answer_tokens"], max_tokens or knobs["answer_tokens"])
+        time.sleep(tokens * knobs["per_token_ms"] / 1000)
+        return tokens, _answer(tokens)
+
+    # --- upstreams ---
+
+    def _iss(self, knobs):
+        self._send(200, {
+            "message": "success",
+            "timestamp": int(time.time()),
+            "iss_position": {
+                "latitude": f"{random.uniform(-51.6, 51.6):.4f}",
+                "longitude": f"{random.uniform(-180, 180):.4f}",
+            },
+        })
+        return 200
+
+    def _nominatim(self, query):
+        def respond(knobs):
+            city = query.get("q", [""])[0].strip().lower()
+            if city not in CITIES:
+                self._send(200, [])
+                return 200
+            lat, lon = CITIES[city]
+            self._send(200, [{
+                "place_id": abs(hash(city)) % 100000,
+                "lat": str(lat),
+                "lon": str(lon),
+                "display_name": city.title(),
+                "boundingbox": [str(lat - 0.5), str(lat + 0.5), str(lon - 0.5), str(lon + 0.5)],
+            }])
+            return 200
+        return respond
+
+    def _gemini(self, body):
+        def respond(knobs):
+            config = body.get("generationConfig") or body.get("generation_config") or {}
+            max_tokens = config.get("maxOutputTokens") or config.get("max_output_tokens")
+            prompt_tokens = len(json.dumps(body.get("contents", ""))) // 4
+            tokens, text = self._generate(knobs, max_tokens)
+            self._send(200, {
+                "candidates": [{
+                    "content": {"parts": [{"text": text}], "role": "model"},
+                    "finishReason": "STOP" if tokens < (max_tokens or tokens + 1) else "MAX_TOKENS",
+                    "index": 0,
+                }],
+                "usageMetadata": {
+                    "promptTokenCount": prompt_tokens,
+                    "candidatesTokenCount": tokens,
+                    "totalTokenCount": prompt_tokens + tokens,
+                },
+            })
+            return 200
+        return respond
+
+    def _openai(self, body):
+        def respond(knobs):
+            max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+            prompt_tokens = len(json.dumps(body.get("messages", ""))) // 4
+            tokens, text = self._generate(knobs, max_tokens)
+            self._send(200, {
+                "id": f"chatcmpl-stub{random.randrange(10**9)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop" if tokens < (max_tokens or tokens + 1) else "length",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": tokens,
+                    "total_tokens": prompt_tokens + tokens,
+                },
+            })
+            return 200
+        return respond
+
+    # --- routing ---
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/iss-now.json":
+            self._handle("iss", self._iss)
+        elif url.path == "/search":
+            self._handle("nominatim", self._nominatim(query))
+        elif url.path == "/_stub/stats":
+            with _lock:
+                self._send(200, dict(_stats))
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        body = self._body()
+        if re.fullmatch(r"/v1beta/models/[^/]+:generateContent", url.path):
+            self._handle("gemini", self._gemini(body), query)
+        elif url.path == "/v1/chat/completions":
+            self._handle("openai", self._openai(body))
+        elif url.path == "/_stub/config":
+            try:
+                configure(body)
+            except KeyError as e:
+                self._send(400, {"error": f"unknown upstream {e}"})
+                return
+            self._send(200, _config)
+        elif url.path == "/_stub/reset":
+            with _lock:
+                _stats.clear()
+            self._send(200, {})
+        else:
+            self._send(404, {"error": "not found"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=DEFAULTS["latency_ms"])
+    args = parser.parse_args()
+
+    configure({name: {"latency_ms": args.latency_ms} for name in UPSTREAMS})
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    print(f"[STUBS] Listening on http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
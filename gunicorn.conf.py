@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for CosmosAI
+The app is imported once in the master (preload_app) so read-only data and
+compiled templates are shared copy-on-write by every worker. Per-worker
+resources (DB connections, HTTP sessions, provider clients, job pools) are
+created lazily after fork; see services/registry.py.
+
+Usage: gunicorn app:app
+"""
+import gc
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+preload_app = True
+
+
+def on_starting(server):
+    # Worker metric snapshots from a previous run would be added to this one
+    metrics_dir = os.getenv("METRICS_DIR")
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.endswith(".json"):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def when_ready(server):
+    # Everything loaded so far is read-only from here on. Freezing it keeps
+    # the cyclic GC from touching (and so un-sharing) those pages in workers.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Pooled connections opened in the master must not be reused by children
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -1,23 +1,101 @@
+import os
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from sqlalchemy import bindparam, event, select
+from sqlalchemy.engine import Engine, make_url
+from services.passwords import hash_password, needs_rehash, verify_password
+from services.identity_cache import user_cache
 
+# Bound to the app in create_app() (app.py)
 db = SQLAlchemy()
 
+# SQLite tuning (ignored for server databases)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+# Connection pool (server databases and file-backed SQLite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+
+def database_uri():
+    """SQLALCHEMY_DATABASE_URI from the environment.
+
+    SQLALCHEMY_DATABASE_URI (or DATABASE_URL) may point at a server
+    database; the default is the local SQLite file.
+    """
+    uri = os.getenv("SQLALCHEMY_DATABASE_URI") or os.getenv("DATABASE_URL") or "sqlite:///users.db"
+    # Heroku-style URLs use the scheme name SQLAlchemy dropped
+    if uri.startswith("postgres://"):
+        uri = "postgresql://" + uri[len("postgres://"):]
+    return uri
+
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for the final database URI."""
+    url = make_url(uri)
+    if url.get_backend_name() != "sqlite":
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_pre_ping": True,
+            "pool_recycle": 1800,
+        }
+    options = {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    if url.database not in (None, "", ":memory:") and url.query.get("mode") != "memory":
+        # File-backed: default QueuePool; write contention is handled by WAL
+        # and the busy timeout. In-memory databases keep SQLAlchemy's
+        # StaticPool, which takes no pool sizes.
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    return options
+
+
+@event.listens_for(Engine, "connect")
+def _tune_sqlite(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the single writer; NORMAL sync is safe under WAL."""
+    if type(dbapi_connection).__module__ != "sqlite3":
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
     email = db.Column(db.String(150), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    last_login = db.Column(db.DateTime)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return needs_rehash(self.password_hash)
+
+    @classmethod
+    def find_by_username(cls, username):
+        return db.session.execute(_BY_USERNAME, {"username": username}).scalar_one_or_none()
+
+    @classmethod
+    def find_by_email(cls, email):
+        return db.session.execute(_BY_EMAIL, {"email": email}).scalar_one_or_none()
 
     def __repr__(self):
         return f'<User {self.username}>'
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    """Password or profile changes must not be served from the identity cache."""
+    user_cache.invalidate(target.id)
+
+
+# Lookups built once; SQLAlchemy's compiled cache and the driver's statement
+# cache then reuse the same prepared SQL on every login
+_BY_USERNAME = select(User).where(User.username == bindparam("username"))
+_BY_EMAIL = select(User).where(User.email == bindparam("email"))
@@ -0,0 +1,69 @@
+"""
+Startup profiler - import-time regression check for CosmosAI
+Runs `python -X importtime -c "import app"` in a fresh interpreter,
+prints the slowest modules, and exits non-zero if:
+1. Total import time exceeds STARTUP_BUDGET_MS (default 1500)
+2. A module that must stay lazy (provider SDKs, Nominatim) was imported
+
+Usage: python profile_startup.py [--top N]
+"""
+import os
+import re
+import subprocess
+import sys
+
+BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "1500"))
+
+# Only imported on first use; loading them at startup is a regression
+MUST_BE_LAZY = (
+    "google.generativeai",
+    "openai",
+    "geopy.geocoders",
+)
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def profile(module="app"):
+    """Return [(module, self_us, cumulative_us, depth)] for a cold import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        sys.exit(2)
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def main():
+    top = int(sys.argv[sys.argv.index("--top") + 1]) if "--top" in sys.argv else 15
+    rows = profile()
+
+    total_ms = sum(cumulative for _, _, cumulative, depth in rows if depth == 0) / 1000
+    print(f"--- IMPORT TIME: {total_ms:.0f} ms (budget {BUDGET_MS:.0f} ms) ---")
+    for name, _, cumulative, _ in sorted(rows, key=lambda r: r[2], reverse=True)[:top]:
+        print(f"{cumulative / 1000:8.1f} ms  {name}")
+
+    eager = [name for name, _, _, _ in rows if name.startswith(MUST_BE_LAZY)]
+    failed = False
+    if eager:
+        print(f"[FAIL] Imported at startup but should be lazy: {', '.join(sorted(set(eager)))}")
+        failed = True
+    if total_ms > BUDGET_MS:
+        print(f"[FAIL] Startup import time over budget by {total_ms - BUDGET_MS:.0f} ms")
+        failed = True
+    if not failed:
+        print("[OK] Startup imports within budget")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,12 @@ Strategy:
 1. Try all Gemini keys (1-5)
 2. Try all OpenAI keys (1-5)
 3. Fallback to Local Data
+
+Provider SDKs are imported, and clients built, on first use so that
+worker start-up and template-only requests never pay for them.
 """
 import os
 import base64
-import google.generativeai as genai
-from openai import OpenAI
 from dotenv import load_dotenv
 from services.astronomy_data import (
     get_chat_response as get_local_chat,
@@ -16,16 +17,53 @@ from services.astronomy_data import (
     get_events,
     get_seasonal_constellation_info,
 )
-from PIL import Image
-import io
+from services.generation import PROFILES, estimate_tokens
+from services.http_client import get_httpx_client
+from services.metrics import AI_CALLS, AI_RESULTS, KEY_ROTATIONS, span, timed
+from services.resilience import CircuitBreaker, Deadline
+from services.singleflight import SingleFlight, flight_key
+from services.utils import image_stats
+import re
+import time
 
 load_dotenv()
 
+# Total latency budget (seconds) per endpoint, shared by every attempt
+LATENCY_BUDGETS = {
+    "analyze": float(os.getenv("AI_BUDGET_ANALYZE", "25")),
+    "batch": float(os.getenv("AI_BUDGET_BATCH", "60")),
+    "chat": float(os.getenv("AI_BUDGET_CHAT", "15")),
+    "dark_sky": float(os.getenv("AI_BUDGET_DARK_SKY", "15")),
+}
+# Cap on any single provider attempt
+PROVIDER_TIMEOUT = float(os.getenv("AI_PROVIDER_TIMEOUT", "12"))
+# Not worth starting an attempt with less than this left
+MIN_ATTEMPT_SECONDS = 1.0
+
+# Alternative Gemini API host (e.g. the bench/stubs.py server), reached
+# over the REST transport so a plain http:// URL works
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+# Frames packed into one vision call by analyze_images
+FRAMES_PER_CALL = int(os.getenv("FRAMES_PER_CALL", "4"))
+
+
+def _import_genai():
+    """Gemini SDK, imported on first use (it takes seconds to load)."""
+    import google.generativeai as genai
+    return genai
+
+
+def _import_openai():
+    """OpenAI SDK, imported on first use."""
+    from openai import OpenAI
+    return OpenAI
+
 
 class CosmosAIHandler:
     """Handles advanced key rotation across multiple providers."""
     
-    def __init__(self):
+    def __init__(self, flight_db=None):
         # Load up to 10 keys per provider
         self.gemini_keys = self._load_keys("GEMINI_AI_KEY")
         self.openai_keys = self._load_keys("OPEN_AI_KEY")
@@ -33,17 +71,20 @@ class CosmosAIHandler:
         self.current_gemini_index = 0
         self.current_openai_index = 0
         
+        # Built lazily for the current key by _init_gemini / _init_openai
         self.gemini_model = None
         self.openai_client = None
+        self._openai_clients = {}
         
         self.gemini_exhausted = False
         self.openai_exhausted = False
-        
-        # Initialize providers
-        if self.gemini_keys:
-            self._init_gemini()
-        if self.openai_keys:
-            self._init_openai()
+
+        # Identical concurrent prompts share one provider call
+        # (across worker processes too when flight_db is given)
+        self.flights = SingleFlight(flight_db)
+
+        # Known-bad providers are skipped instead of waited on
+        self.breakers = {"Gemini": CircuitBreaker("Gemini"), "OpenAI": CircuitBreaker("OpenAI")}
             
         print(f"[INIT] Loaded {len(self.gemini_keys)} Gemini keys and {len(self.openai_keys)} OpenAI keys")
     
@@ -64,24 +105,44 @@ class CosmosAIHandler:
         return keys
     
     def _init_gemini(self):
-        """Initialize Gemini with current key."""
-        if self.current_gemini_index < len(self.gemini_keys):
+        """Return the Gemini model for the current key, building it on first use."""
+        if self.gemini_model is None and self.current_gemini_index < len(self.gemini_keys):
+            genai = _import_genai()
             key = self.gemini_keys[self.current_gemini_index]
-            genai.configure(api_key=key)
+            if GEMINI_API_ENDPOINT:
+                genai.configure(
+                    api_key=key,
+                    transport="rest",
+                    client_options={"api_endpoint": GEMINI_API_ENDPOINT}
+                )
+            else:
+                genai.configure(api_key=key)
             self.gemini_model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        return self.gemini_model
     
     def _init_openai(self):
-        """Initialize OpenAI with current key."""
-        if self.current_openai_index < len(self.openai_keys):
-            key = self.openai_keys[self.current_openai_index]
-            self.openai_client = OpenAI(api_key=key)
+        """Return the OpenAI client for the current key, building it on first use."""
+        index = self.current_openai_index
+        if index < len(self.openai_keys):
+            if index not in self._openai_clients:
+                OpenAI = _import_openai()
+                # No SDK retries: the deadline, breaker and key rotation decide
+                # whether (and where) a failed call is tried again
+                self._openai_clients[index] = OpenAI(
+                    api_key=self.openai_keys[index],
+                    http_client=get_httpx_client(),
+                    max_retries=0
+                )
+            self.openai_client = self._openai_clients[index]
+        return self.openai_client
     
     def _rotate_gemini_key(self):
         """Rotate to next Gemini key."""
         self.current_gemini_index += 1
         if self.current_gemini_index < len(self.gemini_keys):
             print(f"[ROTATE] Switching to Gemini Key #{self.current_gemini_index + 1}")
-            self._init_gemini()
+            KEY_ROTATIONS.inc(provider="Gemini")
+            self.gemini_model = None
             return True
         self.gemini_exhausted = True
         print("[EXHAUSTED] All Gemini keys used. Switching to OpenAI.")
@@ -92,74 +153,106 @@ class CosmosAIHandler:
         self.current_openai_index += 1
         if self.current_openai_index < len(self.openai_keys):
             print(f"[ROTATE] Switching to OpenAI Key #{self.current_openai_index + 1}")
-            self._init_openai()
+            KEY_ROTATIONS.inc(provider="OpenAI")
+            self.openai_client = None
             return True
         self.openai_exhausted = True
         print("[EXHAUSTED] All OpenAI keys used. Switching to Local Mode.")
         return False
     
-    def _call_gemini(self, prompt, image_bytes=None):
-        """Try Gemini with automatic rotation."""
-        if not self.gemini_model or self.gemini_exhausted:
+    def _call_gemini(self, prompt, image_bytes=None, deadline=None, profile=None, rotated=False):
+        """Try Gemini with automatic rotation. image_bytes: one frame or a list."""
+        if not self.gemini_keys or self.gemini_exhausted:
             return {"success": False, "fallback": True}
+        # A retry after key rotation already holds the breaker's permission
+        if not self._attempt_allowed("Gemini", deadline, check_breaker=not rotated):
+            return {"success": False, "fallback": True, "error": "skipped"}
         
+        started = time.monotonic()
         try:
+            genai = _import_genai()
+            model = self._init_gemini()
+            request_options = {"timeout": deadline.timeout(PROVIDER_TIMEOUT)} if deadline else None
+            contents = prompt
+            images = 1
             if image_bytes:
-                image_part = {"mime_type": "image/jpeg", "data": image_bytes}
-                response = self.gemini_model.generate_content(
-                    [prompt, image_part],
+                frames = image_bytes if isinstance(image_bytes, list) else [image_bytes]
+                image_parts = [{"mime_type": "image/jpeg", "data": b} for b in frames]
+                contents = [prompt, *image_parts]
+                images = len(frames)
+            with span("gemini"):
+                response = model.generate_content(
+                    contents,
                     generation_config=genai.types.GenerationConfig(
-                        max_output_tokens=1024,
-                        temperature=0.7
-                    )
+                        max_output_tokens=profile.cap(images),
+                        temperature=profile.temperature
+                    ),
+                    request_options=request_options
                 )
-            else:
-                response = self.gemini_model.generate_content(
-                    prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        max_output_tokens=1024,
-                        temperature=0.7
-                    )
-                )
-            return {"content": response.text, "success": True, "provider": "Gemini"}
+            text = response.text
+            self.breakers["Gemini"].record(True, time.monotonic() - started)
+            AI_CALLS.inc(provider="Gemini", outcome="success")
+            profile.record("Gemini", *self._gemini_usage(response, prompt, text), images=images)
+            return {"content": text, "success": True, "provider": "Gemini"}
         
         except Exception as e:
             error_str = str(e).lower()
             if "429" in str(e) or "quota" in error_str or "resource" in error_str:
+                # Quota is a per-key problem, not a provider outage
+                AI_CALLS.inc(provider="Gemini", outcome="quota")
                 if self._rotate_gemini_key():
-                    return self._call_gemini(prompt, image_bytes)
+                    return self._call_gemini(prompt, image_bytes, deadline, profile, rotated=True)
+                # No outcome for the provider itself; a half-open probe must not stay pending
+                self.breakers["Gemini"].release_probe()
+            else:
+                AI_CALLS.inc(provider="Gemini", outcome="error")
+                self.breakers["Gemini"].record(False, time.monotonic() - started)
             return {"success": False, "fallback": True, "error": str(e)[:100]}
     
-    def _call_openai(self, prompt, image_b64=None):
-        """Try OpenAI with automatic rotation."""
-        if not self.openai_client or self.openai_exhausted:
+    def _call_openai(self, prompt, image_b64=None, deadline=None, profile=None, rotated=False):
+        """Try OpenAI with automatic rotation. image_b64: one frame or a list."""
+        if not self.openai_keys or self.openai_exhausted:
             return {"success": False, "fallback": True}
+        # A retry after key rotation already holds the breaker's permission
+        if not self._attempt_allowed("OpenAI", deadline, check_breaker=not rotated):
+            return {"success": False, "fallback": True, "error": "skipped"}
         
+        started = time.monotonic()
         try:
+            client = self._init_openai()
+            timeout = deadline.timeout(PROVIDER_TIMEOUT) if deadline else PROVIDER_TIMEOUT
+            messages = [{"role": "user", "content": prompt}]
+            images = 1
             if image_b64:
+                frames = image_b64 if isinstance(image_b64, list) else [image_b64]
+                images = len(frames)
                 messages = [
                     {
                         "role": "user", 
                         "content": [
                             {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}", "detail": "low"}}
+                            *[
+                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}", "detail": profile.detail_for(b64)}}
+                                for b64 in frames
+                            ]
                         ]
                     }
                 ]
-                response = self.openai_client.chat.completions.create(
+            with span("openai"):
+                response = client.chat.completions.create(
                     model="gpt-4o-mini",
                     messages=messages,
-                    max_tokens=1024
-                )
-            else:
-                response = self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=1024
+                    max_tokens=profile.cap(images),
+                    temperature=profile.temperature,
+                    timeout=timeout
                 )
             
+            content = response.choices[0].message.content
+            self.breakers["OpenAI"].record(True, time.monotonic() - started)
+            AI_CALLS.inc(provider="OpenAI", outcome="success")
+            profile.record("OpenAI", *self._openai_usage(response, prompt, content), images=images)
             return {
-                "content": response.choices[0].message.content, 
+                "content": content, 
                 "success": True, 
                 "provider": "OpenAI"
             }
@@ -167,73 +260,138 @@ class CosmosAIHandler:
         except Exception as e:
             error_str = str(e).lower()
             if "429" in str(e) or "quota" in error_str or "rate" in error_str:
+                AI_CALLS.inc(provider="OpenAI", outcome="quota")
                 if self._rotate_openai_key():
-                    return self._call_openai(prompt, image_b64)
+                    return self._call_openai(prompt, image_b64, deadline, profile, rotated=True)
+                # No outcome for the provider itself; a half-open probe must not stay pending
+                self.breakers["OpenAI"].release_probe()
+            else:
+                AI_CALLS.inc(provider="OpenAI", outcome="error")
+                self.breakers["OpenAI"].record(False, time.monotonic() - started)
             return {"success": False, "fallback": True, "error": str(e)[:100]}
+
+    def _attempt_allowed(self, provider, deadline, check_breaker=True):
+        """Skip providers whose breaker is open or when the budget is spent."""
+        if deadline and deadline.remaining() < MIN_ATTEMPT_SECONDS:
+            if not check_breaker:
+                self.breakers[provider].release_probe()
+            AI_CALLS.inc(provider=provider, outcome="no_budget")
+            return False
+        if check_breaker and not self.breakers[provider].allow():
+            AI_CALLS.inc(provider=provider, outcome="breaker_open")
+            return False
+        return True
     
-    def _call_ai(self, prompt, image_b64=None):
+    def _call_ai(self, prompt, image_b64=None, budget=None, profile=None):
+        """Run the provider chain once per distinct in-flight prompt/image.
+
+        budget: total seconds the whole chain may take (all attempts).
+        profile: GenerationProfile for the calling endpoint (default: chat).
+        """
+        key = flight_key(prompt, image_b64)
+        deadline = Deadline(budget) if budget is not None else None
+        profile = profile or PROFILES["chat"]
+        # The lease must outlast the whole chain, or another worker would
+        # start a duplicate call while this one is still running
+        return self.flights.do(key, lambda: self._call_chain(prompt, image_b64, deadline, profile), lease_seconds=budget)
+
+    @staticmethod
+    def _gemini_usage(response, prompt, text):
+        """(prompt tokens, completion tokens, truncated) for a Gemini answer."""
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or estimate_tokens(prompt)
+        completion_tokens = getattr(usage, "candidates_token_count", 0) or estimate_tokens(text)
+        finish = response.candidates[0].finish_reason if response.candidates else None
+        return prompt_tokens, completion_tokens, getattr(finish, "name", finish) == "MAX_TOKENS"
+
+    @staticmethod
+    def _openai_usage(response, prompt, content):
+        """(prompt tokens, completion tokens, truncated) for an OpenAI answer."""
+        usage = response.usage
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or estimate_tokens(prompt)
+        completion_tokens = getattr(usage, "completion_tokens", 0) or estimate_tokens(content or "")
+        return prompt_tokens, completion_tokens, response.choices[0].finish_reason == "length"
+
+    def _call_chain(self, prompt, image_b64=None, deadline=None, profile=None):
         """Execute chain: Gemini (Keys 1-5) -> OpenAI (Keys 1-5)."""
-        image_bytes = base64.b64decode(image_b64) if image_b64 else None
+        if isinstance(image_b64, list):
+            image_bytes = [base64.b64decode(b64) for b64 in image_b64]
+        else:
+            image_bytes = base64.b64decode(image_b64) if image_b64 else None
         
         # 1. Try Gemini Chain
-        result = self._call_gemini(prompt, image_bytes)
+        result = self._call_gemini(prompt, image_bytes, deadline, profile)
         if result.get("success"):
+            AI_RESULTS.inc(provider="Gemini")
             return result
             
         # 2. Try OpenAI Chain
-        result = self._call_openai(prompt, image_b64)
+        result = self._call_openai(prompt, image_b64, deadline, profile)
         if result.get("success"):
+            AI_RESULTS.inc(provider="OpenAI")
             return result
             
         # 3. Fallback
+        AI_RESULTS.inc(provider="fallback")
         return {"success": False, "fallback": True}
 
     def analyze_image(self, image_b64):
         """Analyze image with full rotation support."""
-        prompt = """Analyze this astronomy/sky image. Provide:
-
-## 🔭 Sky Analysis
-
-### Detected Objects
-- List visible celestial objects (stars, planets, constellations, nebulae)
-
-### Pattern Recognition
-- **Patterns Found:** (constellation shapes, star trails, etc.)
-- **Mythology:** (cultural significance)
-- **Scientific Context:** (astronomical meaning)
-
-### Viewing Info
-- **Best Time:** When to observe these objects
-- **Next Appearance:** When visible again
-- **Tips:** Observation recommendations
-
-Be specific and educational."""
+        profile = PROFILES["analyze"]
 
-        result = self._call_ai(prompt, image_b64)
+        result = self._call_ai(profile.render(), image_b64, LATENCY_BUDGETS["analyze"], profile)
         if result.get("success"):
             return {"content": result["content"], "provider": result.get("provider")}
         
         return self._local_image_analysis(image_b64)
     
+    def analyze_images(self, frames):
+        """Analyze a session of frames, packing several per vision call.
+
+        frames: list of (name, image_b64). Returns per-frame results plus a
+        session summary computed locally over the whole stack.
+        """
+        stats = [image_stats(b64) for _, b64 in frames]
+        results = [
+            {"name": name, "content": self._local_frame_text(s), "provider": "Local", "stats": s}
+            for (name, _), s in zip(frames, stats)
+        ]
+
+        # One budget for the whole session; once spent, the rest stays local
+        deadline = Deadline(LATENCY_BUDGETS["batch"])
+        for start in range(0, len(frames), FRAMES_PER_CALL):
+            chunk = frames[start:start + FRAMES_PER_CALL]
+            profile = PROFILES["batch"]
+            prompt = profile.render(count=len(chunk))
+            result = self._call_ai(prompt, [b64 for _, b64 in chunk], deadline.remaining(), profile)
+            if not result.get("success"):
+                # Providers are down for this session; keep the local text
+                break
+
+            sections = self._split_frames(result["content"], len(chunk))
+            for offset, text in enumerate(sections):
+                results[start + offset]["content"] = text
+                results[start + offset]["provider"] = result.get("provider")
+
+        return {"frames": results, "summary": self._local_session_summary(stats)}
+
+    @staticmethod
+    def _split_frames(content, count):
+        """Split a multi-frame answer on its '### Frame N' headings.
+
+        If the model ignored the format, every frame gets the whole answer.
+        """
+        parts = re.split(r"^#+\s*Frame\s+\d+.*$", content, flags=re.MULTILINE)[1:]
+        if len(parts) != count:
+            return [content] * count
+        return [part.strip() for part in parts]
+
+    @timed("local_analysis")
     def _local_image_analysis(self, image_b64):
         """Local fallback analysis."""
         try:
-            image_bytes = base64.b64decode(image_b64)
-            img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            pixels = list(img.getdata())
-            num_pixels = len(pixels)
-            
-            total_bright = sum((r+g+b)/3 for r,g,b in pixels)
-            avg = total_bright / num_pixels
-            bright_spots = sum(1 for r,g,b in pixels if (r+g+b)/3 > 200)
-            
             lines = ["## 🔭 Sky Analysis (Local Mode)\n\n"]
-            if avg < 50: lines.append("### Sky Quality: ★★★★★ Excellent\n")
-            elif avg < 100: lines.append("### Sky Quality: ★★★★☆ Good\n")
-            else: lines.append("### Sky Quality: ★★★☆☆ Fair\n")
-            
-            if bright_spots > num_pixels * 0.01:
-                lines.append(f"\n### Detected: {bright_spots} bright points\n")
+            lines.append(self._local_frame_text(image_stats(image_b64)))
                 
             seasonal = get_seasonal_constellation_info()
             lines.append(f"\n### Current Season: {seasonal['highlight']}\n")
@@ -243,19 +401,44 @@ Be specific and educational."""
         except:
             return {"error": "Image analysis failed"}
 
+    @staticmethod
+    def _sky_quality(avg):
+        if avg < 50: return "★★★★★ Excellent"
+        elif avg < 100: return "★★★★☆ Good"
+        return "★★★☆☆ Fair"
+
+    def _local_frame_text(self, stats):
+        """Sky quality and bright point count for one frame's stats."""
+        lines = [f"### Sky Quality: {self._sky_quality(stats['avg_brightness'])}\n"]
+        if stats["bright_spots"] > stats["num_pixels"] * 0.01:
+            lines.append(f"\n### Detected: {stats['bright_spots']} bright points\n")
+        return "".join(lines)
+
+    def _local_session_summary(self, stats):
+        """Summary over the whole stack of frames."""
+        if not stats:
+            return ""
+        brightness = [s["avg_brightness"] for s in stats]
+        best = brightness.index(min(brightness))
+        avg = sum(brightness) / len(brightness)
+
+        lines = [f"## 🔭 Session Summary ({len(stats)} frames)\n\n"]
+        lines.append(f"### Sky Quality: {self._sky_quality(avg)}\n")
+        lines.append(f"- **Darkest Frame:** #{best + 1}\n")
+        lines.append(f"- **Brightness Range:** {min(brightness):.0f} - {max(brightness):.0f}\n")
+        lines.append(f"- **Bright Points (total):** {sum(s['bright_spots'] for s in stats)}\n")
+
+        seasonal = get_seasonal_constellation_info()
+        lines.append(f"\n### Current Season: {seasonal['highlight']}\n")
+        lines.append(f"- **Constellations:** {', '.join(seasonal['constellations'])}\n")
+        return "".join(lines)
+
     def get_chatbot_response(self, message, history=None):
         """Chat with full rotation support."""
-        prompt = f"""You are CosmosAI. Be accurate, educational, and engaging.
-        
-        User: {message}
+        profile = PROFILES["chat"]
+        prompt = profile.render(message=message)
         
-        Guidelines:
-        - Use bold for key terms
-        - 2-4 paragraphs
-        - Include interesting facts
-        """
-        
-        result = self._call_ai(prompt)
+        result = self._call_ai(prompt, budget=LATENCY_BUDGETS["chat"], profile=profile)
         if result.get("success"):
             return f"*[{result['provider']}]* {result['content']}"
             
@@ -266,15 +449,10 @@ Be specific and educational."""
         """Dark sky finder with full rotation support."""
         if not city: return {"suggestion": "Please enter a city."}
         
-        prompt = f"""Find stargazing spots near {city}. 
-        Format:
-        #### [Name] ★★★★★
-        - **Distance:**
-        - **Bortle:**
-        - **Tips:**
-        """
+        profile = PROFILES["dark_sky"]
+        prompt = profile.render(city=city)
         
-        result = self._call_ai(prompt)
+        result = self._call_ai(prompt, budget=LATENCY_BUDGETS["dark_sky"], profile=profile)
         if result.get("success"):
             return {"suggestion": f"*[{result['provider']}]*\n\n{result['content']}"}
             
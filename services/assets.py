@@ -0,0 +1,170 @@
+"""
+Static Asset Pipeline - fingerprinted, precompressed CSS/JS
+Strategy:
+1. `flask --app app build-assets` copies each source asset to
+   static/dist/<name>.<content-hash><ext> with .gz (and .br when the
+   brotli package is installed) variants next to it, plus a manifest
+2. Templates call asset_url('css/style.css'), which resolves through the
+   manifest to /assets/css/style.<hash>.css
+3. /assets/ serves only the files named in the manifest, picks the best
+   pre-built encoding for the client and marks the response immutable, so
+   repeat visits make no static requests at all
+At startup the manifest is checked against the current sources and rebuilt
+when any of them changed; without a (current) manifest, asset_url falls
+back to the plain /static/ URL.
+"""
+import gzip
+import hashlib
+import json
+import os
+from flask import Blueprint, current_app, request, send_file, url_for
+
+ASSET_SOURCES = ("css/style.css", "js/main.js")
+DIST_DIR = "dist"
+MANIFEST = "manifest.json"
+# Fingerprinted names never change content, so they can be cached forever
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+assets = Blueprint("assets", __name__)
+
+
+def _brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+
+def build_assets(static_folder):
+    """Build fingerprinted + compressed copies of ASSET_SOURCES; return the manifest."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    brotli = _brotli()
+    manifest = {}
+
+    for source in ASSET_SOURCES:
+        with open(os.path.join(static_folder, source), "rb") as f:
+            data = f.read()
+        hashed = _hashed_name(source, data)
+        target = os.path.join(dist, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        with open(target, "wb") as f:
+            f.write(data)
+        # mtime=0 keeps the gzip output reproducible between builds
+        with open(target + ".gz", "wb") as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli:
+            with open(target + ".br", "wb") as f:
+                f.write(brotli.compress(data, quality=11))
+        manifest[source] = hashed
+
+    with open(os.path.join(dist, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _hashed_name(source, data):
+    stem, ext = os.path.splitext(source)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def _stale_entries(static_folder, manifest):
+    """Sources whose manifest entry no longer matches the file on disk."""
+    stale = []
+    for source in ASSET_SOURCES:
+        try:
+            with open(os.path.join(static_folder, source), "rb") as f:
+                current = _hashed_name(source, f.read())
+        except OSError:
+            continue
+        built = os.path.join(static_folder, DIST_DIR, current)
+        if manifest.get(source) != current or not os.path.isfile(built):
+            stale.append(source)
+    return stale
+
+
+def _load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def init_assets(app):
+    """Load (or build) the manifest and register asset_url / the /assets route."""
+    manifest = _load_manifest(app.static_folder) or {}
+    stale = _stale_entries(app.static_folder, manifest)
+    if stale and os.getenv("ASSETS_AUTOBUILD", "1") == "1":
+        try:
+            manifest = build_assets(app.static_folder)
+            stale = []
+        except OSError as e:
+            # Read-only deployments fall back to plain /static/ URLs
+            print(f"[ASSETS] Could not build assets: {e}")
+    for source in stale:
+        # Never point templates at an outdated, immutably cached file
+        print(f"[ASSETS] {source} changed since the last build; serving it from /static/")
+        manifest.pop(source, None)
+    app.extensions["asset_manifest"] = manifest
+
+    app.register_blueprint(assets)
+
+    @app.cli.command("build-assets")
+    def build_assets_command():
+        """Fingerprint and precompress static assets."""
+        built = build_assets(app.static_folder)
+        app.extensions["asset_manifest"] = built
+        for source, hashed in built.items():
+            print(f"{source} -> {DIST_DIR}/{hashed}")
+
+    @app.context_processor
+    def asset_helpers():
+        return {"asset_url": asset_url}
+
+
+def asset_url(path):
+    """URL for a static asset, fingerprinted when a manifest is available."""
+    hashed = current_app.extensions.get("asset_manifest", {}).get(path)
+    if hashed:
+        return url_for("assets.dist", filename=hashed)
+    return url_for("static", filename=path)
+
+
+@assets.route("/assets/<path:filename>")
+def dist(filename):
+    # Only fingerprinted files may be cached as immutable; the manifest
+    # itself (and anything else left in dist/) changes between builds
+    if filename not in current_app.extensions.get("asset_manifest", {}).values():
+        return "Not Found", 404
+    dist_dir = os.path.join(current_app.static_folder, DIST_DIR)
+    path = os.path.normpath(os.path.join(dist_dir, filename))
+    if not path.startswith(dist_dir + os.sep) or not os.path.isfile(path):
+        return "Not Found", 404
+
+    encoding = None
+    for name, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings[name] > 0 and os.path.isfile(path + suffix):
+            encoding, path = name, path + suffix
+            break
+
+    response = send_file(
+        path,
+        mimetype=_mimetype(filename),
+        conditional=True,
+        max_age=31536000,
+    )
+    response.headers["Cache-Control"] = IMMUTABLE
+    response.headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def _mimetype(filename):
+    if filename.endswith(".css"):
+        return "text/css; charset=utf-8"
+    if filename.endswith(".js"):
+        return "text/javascript; charset=utf-8"
+    return None
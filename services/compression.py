@@ -0,0 +1,119 @@
+"""
+Response Compression - gzip/brotli negotiation and ETags for dynamic responses
+Strategy:
+1. Views marked @cacheable get a weak ETag on GET, and a matching
+   If-None-Match turns the response into a 304 with no body
+2. Text responses (HTML, JSON, markdown...) of at least COMPRESS_MIN_SIZE
+   bytes are compressed with brotli when the client accepts it and the
+   package is installed, otherwise gzip
+3. Streamed responses are compressed chunk by chunk with a sync flush, so
+   each chunk still reaches the client as soon as it is produced
+Files sent with send_file (and pre-compressed /assets/) are left alone.
+"""
+import gzip
+import os
+import zlib
+from functools import wraps
+from flask import request
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "500"))
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE = {
+    "text/html",
+    "text/plain",
+    "text/markdown",
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def cacheable(f):
+    """Mark a GET view as safe to answer with ETag / 304."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        request.environ["cosmos.cacheable"] = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def init_compression(app):
+    app.after_request(finalize_response)
+
+
+def finalize_response(response):
+    """ETag first (on the uncompressed body), then compression."""
+    if request.environ.get("cosmos.cacheable") and request.method == "GET" and response.status_code == 200:
+        # Responses are per user, so only the browser may cache them, and
+        # must revalidate each time; the ETag makes that revalidation cheap
+        response.headers.setdefault("Cache-Control", "private, no-cache")
+        response.add_etag(weak=True)
+        response.make_conditional(request)
+
+    encoding = _choose_encoding(response)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(_compress(data, encoding))
+
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _choose_encoding(response):
+    if (
+        response.direct_passthrough
+        or not 200 <= response.status_code < 300
+        or response.status_code in (204, 206)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE
+        or "no-transform" in response.headers.get("Cache-Control", "")
+        or request.method == "HEAD"
+    ):
+        return None
+    if brotli is not None and request.accept_encodings["br"] > 0:
+        return "br"
+    if request.accept_encodings["gzip"] > 0:
+        return "gzip"
+    return None
+
+
+def _compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compress_stream(chunks, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        # wbits=31 writes a gzip header/trailer around the deflate stream
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
@@ -0,0 +1,193 @@
+"""
+Generation Profiles - per-endpoint output caps, prompts and image detail
+Generation time grows with the length of the answer, so each endpoint asks
+for no more than it needs.
+Strategy:
+1. Each endpoint has a GenerationProfile: output token cap, temperature
+   and a prompt template dedented once at import (no indentation sent)
+2. User text is counted (estimated) in tokens before sending and trimmed
+   to the profile's input budget
+3. OpenAI image detail is picked from the frame size: "high" only when the
+   frame is larger than one low-detail tile and its tiles fit the image
+   token budget
+4. Provider-reported prompt/completion tokens are recorded per provider;
+   once enough answers are seen, the cap follows their p95 plus headroom
+   (answers cut off at the cap count as the ceiling, pushing it back up)
+Token counts use a ~4 characters/token estimate; no tokenizer download.
+"""
+import base64
+import io
+import math
+import os
+import textwrap
+import threading
+from collections import deque
+
+from PIL import Image
+
+from services.metrics import AI_TOKENS, AI_TRUNCATED
+
+ADAPTIVE_CAPS = os.getenv("AI_ADAPTIVE_CAPS", "1") == "1"
+# Answers observed before the cap adapts, and how many are kept
+ADAPT_MIN_SAMPLES = int(os.getenv("AI_ADAPT_MIN_SAMPLES", "20"))
+ADAPT_WINDOW = 200
+ADAPT_HEADROOM = 1.25
+
+CHARS_PER_TOKEN = 4
+# OpenAI vision pricing: one fixed-cost image at "low", tiles at "high"
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+TILE_PX = 512
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def trim_to_tokens(text, max_tokens):
+    """Cut text down to about max_tokens, on a word boundary."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cut = text[:max_tokens * CHARS_PER_TOKEN]
+    return cut.rsplit(" ", 1)[0] if " " in cut else cut
+
+
+def high_detail_tokens(width, height):
+    """Token cost of an image sent at detail "high"."""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / TILE_PX) * math.ceil(height / TILE_PX)
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * tiles
+
+
+class GenerationProfile:
+    """Generation settings for one endpoint, with an adaptive output cap."""
+
+    def __init__(self, name, template, max_tokens, temperature, min_tokens=64,
+                 max_input_tokens=None, image_detail="low", image_token_budget=0):
+        self.name = name
+        self.template = textwrap.dedent(template).strip()
+        env = name.upper()
+        self.max_tokens = int(os.getenv(f"AI_MAX_TOKENS_{env}", str(max_tokens)))
+        self.temperature = float(os.getenv(f"AI_TEMPERATURE_{env}", str(temperature)))
+        self.min_tokens = min(min_tokens, self.max_tokens)
+        self.max_input_tokens = max_input_tokens
+        self.image_detail = os.getenv(f"AI_IMAGE_DETAIL_{env}", image_detail)
+        self.image_token_budget = image_token_budget
+
+        self._cap = self.max_tokens
+        self._lengths = deque(maxlen=ADAPT_WINDOW)
+        self._lock = threading.Lock()
+
+    def render(self, **fields):
+        """Prompt with user fields trimmed to the input budget."""
+        if self.max_input_tokens:
+            fields = {
+                key: trim_to_tokens(str(value), self.max_input_tokens)
+                for key, value in fields.items()
+            }
+        return self.template.format(**fields)
+
+    def cap(self, images=1):
+        """Output token cap for this call (batch prompts scale per image)."""
+        return self._cap * max(images, 1)
+
+    def detail_for(self, image_b64):
+        """OpenAI image detail for one frame."""
+        if self.image_detail != "auto":
+            return self.image_detail
+        try:
+            width, height = Image.open(io.BytesIO(base64.b64decode(image_b64))).size
+        except Exception:
+            return "low"
+        if max(width, height) <= TILE_PX:
+            # One low-detail image already covers it
+            return "low"
+        if high_detail_tokens(width, height) > self.image_token_budget:
+            return "low"
+        return "high"
+
+    def record(self, provider, prompt_tokens, completion_tokens, truncated=False, images=1):
+        """Record usage for one answer and adapt the cap."""
+        AI_TOKENS.inc(prompt_tokens, provider=provider, endpoint=self.name, kind="prompt")
+        AI_TOKENS.inc(completion_tokens, provider=provider, endpoint=self.name, kind="completion")
+        if truncated:
+            AI_TRUNCATED.inc(provider=provider, endpoint=self.name)
+        if not ADAPTIVE_CAPS:
+            return
+
+        per_image = completion_tokens / max(images, 1)
+        with self._lock:
+            # A cut-off answer wanted at least the cap; count it as the ceiling
+            self._lengths.append(self.max_tokens if truncated else per_image)
+            if len(self._lengths) >= ADAPT_MIN_SAMPLES:
+                ordered = sorted(self._lengths)
+                p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+                self._cap = max(self.min_tokens, min(self.max_tokens, int(p95 * ADAPT_HEADROOM)))
+
+
+PROFILES = {
+    "analyze": GenerationProfile(
+        "analyze",
+        """
+        Analyze this astronomy/sky image. Answer in markdown:
+
+        ## 🔭 Sky Analysis
+        ### Detected Objects
+        Visible stars, planets, constellations, nebulae.
+        ### Pattern Recognition
+        - **Patterns Found:** constellation shapes, star trails...
+        - **Mythology:** cultural significance
+        - **Scientific Context:** astronomical meaning
+        ### Viewing Info
+        - **Best Time:** / **Next Appearance:** / **Tips:**
+
+        Be specific and educational; one or two lines per point.
+        """,
+        max_tokens=700, temperature=0.4,
+        image_detail="auto", image_token_budget=int(os.getenv("AI_IMAGE_TOKEN_BUDGET", "500")),
+    ),
+    "batch": GenerationProfile(
+        "batch",
+        """
+        You are given {count} astronomy/sky images from one observing session.
+        For EACH image, in order, write a section starting with the heading "### Frame N"
+        (N = 1..{count}) containing:
+        - **Detected Objects:** visible celestial objects
+        - **Patterns:** constellation shapes, star trails, etc.
+        - **Quality:** focus, noise, light pollution, clouds
+
+        Keep each section short and specific.
+        """,
+        # Per frame; a call with N frames gets N times this
+        max_tokens=250, temperature=0.4, min_tokens=48,
+    ),
+    "chat": GenerationProfile(
+        "chat",
+        """
+        You are CosmosAI. Be accurate, educational, and engaging.
+
+        User: {message}
+
+        Guidelines:
+        - Use bold for key terms
+        - 2-4 short paragraphs
+        - Include interesting facts
+        """,
+        max_tokens=450, temperature=0.7, max_input_tokens=1000,
+    ),
+    "dark_sky": GenerationProfile(
+        "dark_sky",
+        """
+        Find 3-5 stargazing spots near {city}.
+        Format each as:
+        #### [Name] ★★★★★
+        - **Distance:**
+        - **Bortle:**
+        - **Tips:** (one line)
+        """,
+        max_tokens=400, temperature=0.5, max_input_tokens=50,
+    ),
+}
@@ -0,0 +1,143 @@
+"""
+HTTP Client - one pooled outbound HTTP layer for every service
+Strategy:
+1. One requests.Session per worker process: per-host connection pools
+   with keep-alive, so repeat calls skip the TCP/TLS handshake
+2. Default (connect, read) timeouts on every request
+3. Idempotent requests retry on connect errors and 502/503/504 with
+   jittered exponential backoff
+4. A per-host semaphore caps concurrent calls, so a slow upstream cannot
+   pile up threads without limit
+The OpenAI SDK (httpx) and geopy's Nominatim get adapters onto the same
+settings. Upstream URLs are configurable so a local stub server can
+stand in for them.
+"""
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HOST_CONCURRENCY = int(os.getenv("HTTP_HOST_CONCURRENCY", "8"))
+RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.3"))
+JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", "0.2"))
+
+
+class HostBusyError(requests.exceptions.ConnectionError):
+    """Too many calls already in flight to this host."""
+
+
+class PooledSession(requests.Session):
+    """Session with default timeouts and a per-host concurrency limit."""
+
+    def __init__(self):
+        super().__init__()
+        retry_options = dict(
+            total=RETRIES,
+            connect=RETRIES,
+            read=RETRIES,
+            status=RETRIES,
+            backoff_factor=BACKOFF,
+            status_forcelist=(502, 503, 504),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        try:
+            retry = Retry(backoff_jitter=JITTER, **retry_options)
+        except TypeError:
+            # urllib3 < 2 has no jitter option
+            retry = Retry(**retry_options)
+
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+        self._limits = {}
+        self._limits_lock = threading.Lock()
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        with self._limits_lock:
+            if host not in self._limits:
+                self._limits[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+            return self._limits[host]
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+        limit = self._host_limit(url)
+        # Waiting for a slot counts like waiting for a connection
+        if not limit.acquire(timeout=CONNECT_TIMEOUT):
+            raise HostBusyError(f"Too many concurrent requests to {urlsplit(url).netloc}")
+        try:
+            return super().request(method, url, **kwargs)
+        finally:
+            limit.release()
+
+
+_session = None
+_httpx_client = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """The process-wide pooled session."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = PooledSession()
+    return _session
+
+
+def get_httpx_client():
+    """Shared httpx client for SDKs built on httpx (OpenAI)."""
+    global _httpx_client
+    if _httpx_client is None:
+        with _lock:
+            if _httpx_client is None:
+                import httpx
+                _httpx_client = httpx.Client(
+                    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                    limits=httpx.Limits(
+                        max_connections=POOL_SIZE,
+                        max_keepalive_connections=POOL_SIZE,
+                    ),
+                )
+    return _httpx_client
+
+
+def geopy_adapter_factory(proxies=None, ssl_context=None):
+    """adapter_factory for geopy geocoders, routed through get_session()."""
+    from geopy.adapters import BaseSyncAdapter, RequestsAdapter
+
+    class PooledGeopyAdapter(RequestsAdapter):
+        def __init__(self, *, proxies, ssl_context):
+            # Skip RequestsAdapter.__init__, which builds a private session
+            BaseSyncAdapter.__init__(self, proxies=proxies, ssl_context=ssl_context)
+            self.session = get_session()
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+        def __del__(self):
+            # The session is shared; never close it with the geocoder
+            pass
+
+    return PooledGeopyAdapter(proxies=proxies, ssl_context=ssl_context)
+
+
+def _reset_after_fork():
+    global _session, _httpx_client, _lock
+    _session = None
+    _httpx_client = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
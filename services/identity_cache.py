@@ -0,0 +1,89 @@
+"""
+Identity Cache - in-process cache in front of the user loader
+Flask-Login resolves current_user on every authenticated request; this
+keeps a small record per user so the common case never touches the DB.
+Strategy:
+1. Entries expire after USER_CACHE_TTL seconds (bounds staleness across
+   worker processes, which each hold their own cache)
+2. Updates and deletes of a User invalidate its entry in this process
+3. At most USER_CACHE_SIZE entries, least recently used evicted first
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+
+class CachedUser:
+    """Lightweight, read-only stand-in for the User model as current_user."""
+
+    __slots__ = ("id", "username", "email")
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(user.id, user.username, user.email)
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id and hasattr(other, "get_id")
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+class IdentityCache:
+    """TTL + LRU cache of CachedUser records keyed by user id."""
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_size=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # id -> (expires, CachedUser)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user):
+        record = CachedUser.from_model(user)
+        with self._lock:
+            self._entries[record.id] = (time.monotonic() + self.ttl, record)
+            self._entries.move_to_end(record.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return record
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = IdentityCache()
@@ -1,19 +1,35 @@
-import requests
-from geopy.distance import geodesic
-from geopy.geocoders import Nominatim
+import os
+from services.http_client import READ_TIMEOUT, geopy_adapter_factory, get_session
+from services.metrics import span, timed
 
 class ISSService:
     def __init__(self):
-        self.api_url = "http://api.open-notify.org/iss-now.json"
-        # Initialize geolocator with a unique user_agent
-        self.geolocator = Nominatim(user_agent="cosmos_ai_app")
+        self.api_url = os.getenv("ISS_API_URL", "http://api.open-notify.org/iss-now.json")
+        self._geolocator = None
 
+    @property
+    def geolocator(self):
+        """Nominatim client, created on the first geocode rather than at startup."""
+        if self._geolocator is None:
+            from geopy.geocoders import Nominatim
+            # Initialize geolocator with a unique user_agent, sharing the
+            # pooled HTTP session with every other outbound call
+            self._geolocator = Nominatim(
+                user_agent="cosmos_ai_app",
+                domain=os.getenv("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org"),
+                scheme=os.getenv("NOMINATIM_SCHEME", "https"),
+                timeout=READ_TIMEOUT,
+                adapter_factory=geopy_adapter_factory,
+            )
+        return self._geolocator
+
+    @timed("iss_location")
     def get_iss_location(self):
         """
         Fetch live ISS location.
         """
         try:
-            response = requests.get(self.api_url)
+            response = get_session().get(self.api_url)
             response.raise_for_status()
             data = response.json()
             position = data['iss_position']
@@ -31,7 +47,8 @@ class ISSService:
         """
         try:
             # Get user coordinates
-            location = self.geolocator.geocode(user_city)
+            with span("geocode"):
+                location = self.geolocator.geocode(user_city)
             if not location:
                 return {"error": "City not found."}
             
@@ -44,7 +61,9 @@ class ISSService:
             
             iss_coords = (iss_data['latitude'], iss_data['longitude'])
             
-            # Calculate distance
+            # Calculate distance (geopy's package import pulls in every
+            # geocoder, so it is deferred to the first visibility check)
+            from geopy.distance import geodesic
             distance = geodesic(user_coords, iss_coords).km
             
             is_visible = distance <= radius_km
@@ -0,0 +1,195 @@
+"""
+Job Queue - Background execution for slow endpoints
+Jobs run in a local worker pool; their state and results live in a
+SQLite file so any worker process can answer a poll.
+Strategy:
+1. Identical in-flight jobs (same key) are merged into one
+2. Completed results are kept for a TTL and reused
+3. Expired rows are purged on submit; jobs orphaned by a dead worker
+   are failed after JOB_TIMEOUT (on submit and on poll) so the key can
+   be retried and pollers stop waiting
+4. Each job holds its upload in memory until it runs, so at most
+   JOB_MAX_PENDING jobs may be queued or running per process; beyond
+   that submit raises QueueFull instead of growing the backlog
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    finished REAL
+)
+"""
+
+
+class QueueFull(RuntimeError):
+    """Too many jobs already queued or running in this process."""
+
+
+class JobQueue:
+    """Runs callables in a bounded pool and stores their results in SQLite."""
+
+    def __init__(self, db_path, workers=None, result_ttl=None, job_timeout=None, max_pending=None):
+        self.db_path = db_path
+        self.workers = workers or int(os.getenv("JOB_WORKERS", "2"))
+        self.result_ttl = result_ttl or int(os.getenv("JOB_RESULT_TTL", "600"))
+        self.job_timeout = job_timeout or int(os.getenv("JOB_TIMEOUT", "300"))
+        self.max_pending = max_pending or int(os.getenv("JOB_MAX_PENDING", "8"))
+
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)")
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit mode: each statement commits on its own unless an
+        # explicit BEGIN is issued.
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _pool(self):
+        """Create the worker pool on first use (never in the importing process)."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="cosmos-job"
+                )
+            return self._executor
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) under key and return the job id.
+
+        If a job with the same key is queued, running, or finished within
+        the TTL, its id is returned instead and no new work is scheduled.
+        Raises QueueFull when max_pending jobs are already queued or running.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?",
+                (now - self.result_ttl,),
+            )
+            self._fail_orphans(conn, now)
+            # BEGIN IMMEDIATE takes the write lock so two processes cannot
+            # both decide they are first for the same key.
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE key = ? AND status != ? "
+                "ORDER BY created DESC LIMIT 1",
+                (key, FAILED),
+            ).fetchone()
+            if row:
+                conn.execute("COMMIT")
+                return row["id"]
+            if not self._slots.acquire(blocking=False):
+                conn.execute("ROLLBACK")
+                raise QueueFull("Too many analyses in progress")
+
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, key, status, created) VALUES (?, ?, ?, ?)",
+                (job_id, key, QUEUED, now),
+            )
+            conn.execute("COMMIT")
+
+        try:
+            future = self._pool().submit(self._run, job_id, fn, args)
+        except BaseException:
+            self._slots.release()
+            self._finish(job_id, FAILED, error="Could not schedule job")
+            raise
+        # The slot (and the upload it holds) is freed once the job is done
+        future.add_done_callback(lambda _: self._slots.release())
+        return job_id
+
+    def _fail_orphans(self, conn, now, job_id=None):
+        """Fail unfinished jobs older than job_timeout (their worker is gone)."""
+        query = "UPDATE jobs SET status = ?, error = ?, finished = ? WHERE finished IS NULL AND created < ?"
+        params = [FAILED, "Job timed out", now, now - self.job_timeout]
+        if job_id is not None:
+            query += " AND id = ?"
+            params.append(job_id)
+        conn.execute(query, params)
+
+    def _run(self, job_id, fn, args):
+        self._set_status(job_id, RUNNING)
+        try:
+            result = fn(*args)
+            self._finish(job_id, DONE, result=json.dumps(result))
+        except Exception as e:
+            print(f"[JOB] {job_id} failed: {e}")
+            self._finish(job_id, FAILED, error=str(e)[:200])
+
+    def _set_status(self, job_id, status):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+        with self._done:
+            self._done.notify_all()
+
+    def get(self, job_id):
+        """Return the job as a dict, or None if unknown or expired."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row and row["finished"] is None and row["created"] < time.time() - self.job_timeout:
+                self._fail_orphans(conn, time.time(), job_id)
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        if row["finished"] and row["finished"] < time.time() - self.result_ttl:
+            return None
+
+        job = {"job_id": row["id"], "status": row["status"]}
+        if row["status"] == DONE:
+            job["result"] = json.loads(row["result"])
+        elif row["status"] == FAILED:
+            job["error"] = row["error"]
+        return job
+
+    def wait(self, job_id, timeout):
+        """Block up to timeout seconds for the job to finish, then return it.
+
+        Jobs run by this process wake waiters immediately; jobs owned by
+        another worker process are picked up by re-reading the store.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in (DONE, FAILED) or remaining <= 0:
+                return job
+            with self._done:
+                self._done.wait(min(remaining, 0.5))
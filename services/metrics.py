@@ -0,0 +1,311 @@
+"""
+Metrics - counters, latency histograms and Server-Timing spans
+Strategy:
+1. Counter / Histogram keep plain in-memory sums per label set; recording
+   is a lock and a bisect, cheap enough to leave on in production
+2. span("name") times a block into cosmos_operation_seconds and, when
+   SERVER_TIMING=1, into the response's Server-Timing header
+3. Every request is timed per endpoint/method/status
+4. GET /metrics serves the Prometheus text format. Under gunicorn, set
+   METRICS_DIR: each worker writes its snapshot there every
+   METRICS_FLUSH_INTERVAL seconds and a scrape adds them all up
+   (gunicorn.conf.py empties the directory on startup)
+5. /metrics needs METRICS_TOKEN as a bearer token; without one it only
+   answers direct (unproxied) connections from localhost, unless
+   METRICS_PUBLIC=1
+"""
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Blueprint, Response, g, has_request_context, request
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "0") == "1"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Name on the HELP/TYPE lines; counter samples carry the _total suffix
+        self.exposed_name = name + "_total" if self.kind == "counter" else name
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def samples(self, key, value):
+        yield self.exposed_name, key, value
+
+
+class Histogram(Counter):
+    """Bucketed observations (seconds) per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(state) for key, state in self._values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self, key, state):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), state):
+            cumulative += count
+            yield self.name + "_bucket", key + (("le", _format(bound)),), cumulative
+        yield self.name + "_sum", key, state[-1]
+        yield self.name + "_count", key, cumulative
+
+
+REQUEST_SECONDS = Histogram(
+    "cosmos_http_request_seconds", "Time spent handling a request",
+    ("endpoint", "method", "status"),
+)
+OPERATION_SECONDS = Histogram(
+    "cosmos_operation_seconds", "Time spent in an instrumented operation",
+    ("operation",),
+)
+AI_CALLS = Counter(
+    "cosmos_ai_calls", "Provider call attempts by outcome",
+    ("provider", "outcome"),
+)
+AI_RESULTS = Counter(
+    "cosmos_ai_results", "Which provider answered a request (fallback = local mode)",
+    ("provider",),
+)
+AI_TOKENS = Counter(
+    "cosmos_ai_tokens", "Prompt/completion tokens reported by providers",
+    ("provider", "endpoint", "kind"),
+)
+AI_TRUNCATED = Counter(
+    "cosmos_ai_truncated", "Answers cut off at the output token cap",
+    ("provider", "endpoint"),
+)
+KEY_ROTATIONS = Counter(
+    "cosmos_ai_key_rotations", "API key rotations after quota errors",
+    ("provider",),
+)
+
+
+@contextmanager
+def span(name):
+    """Time a block as operation `name` (and a Server-Timing entry)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        OPERATION_SECONDS.observe(elapsed, operation=name)
+        if SERVER_TIMING and has_request_context():
+            g.setdefault("cosmos_spans", []).append((name, elapsed))
+
+
+def timed(name):
+    """Decorator form of span()."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- Flask integration ---
+
+metrics = Blueprint("metrics", __name__)
+_last_flush = 0.0
+
+
+def init_metrics(app):
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.register_blueprint(metrics)
+
+
+def _start_timer():
+    g.cosmos_started = time.perf_counter()
+
+
+def _record_request(response):
+    started = g.get("cosmos_started")
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    REQUEST_SECONDS.observe(
+        elapsed,
+        endpoint=request.endpoint or "none",
+        method=request.method,
+        status=response.status_code,
+    )
+    if SERVER_TIMING:
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in g.get("cosmos_spans", ())]
+        entries.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers.add("Server-Timing", ", ".join(entries))
+    if METRICS_DIR and time.monotonic() - _last_flush > METRICS_FLUSH_INTERVAL:
+        flush()
+    return response
+
+
+@metrics.route("/metrics")
+def metrics_endpoint():
+    if METRICS_TOKEN:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied, METRICS_TOKEN):
+            return "Unauthorized", 401
+    elif not METRICS_PUBLIC and not _direct_local_request():
+        return "Forbidden", 403
+    if METRICS_DIR:
+        flush()
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+def _direct_local_request():
+    """True for a scrape from this host that did not come through a proxy."""
+    # ProxyFix keeps the socket's address here; remote_addr may be a
+    # forwarded (and so client-supplied) one
+    environ = request.environ.get("werkzeug.proxy_fix.orig", request.environ)
+    if request.headers.get("X-Forwarded-For"):
+        return False
+    return environ.get("REMOTE_ADDR") in ("127.0.0.1", "::1")
+
+
+# --- Exposition ---
+
+def flush():
+    """Write this process's metrics to METRICS_DIR for other workers to read."""
+    global _last_flush
+    _last_flush = time.monotonic()
+    data = {
+        metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+        for metric in _registry
+    }
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"[METRICS] Could not write snapshot: {e}")
+
+
+def _collect():
+    """{metric: {label values: value}}, summed over all worker snapshots."""
+    if not METRICS_DIR:
+        return {metric: metric.snapshot() for metric in _registry}
+
+    by_name = {metric.name: metric for metric in _registry}
+    totals = {metric: {} for metric in _registry}
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, series in data.items():
+            metric = by_name.get(name)
+            if metric is None:
+                continue
+            for key, value in series:
+                key = tuple(key)
+                totals[metric][key] = metric.merge(totals[metric].get(key), value)
+    return totals
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric, series in _collect().items():
+        lines.append(f"# HELP {metric.exposed_name} {metric.help}")
+        lines.append(f"# TYPE {metric.exposed_name} {metric.kind}")
+        for key, value in sorted(series.items()):
+            labels = tuple(zip(metric.labels, key))
+            for name, sample_labels, sample in metric.samples(labels, value):
+                lines.append(f"{name}{_labels(sample_labels)} {_format(sample)}")
+    return "\n".join(lines) + "\n"
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value):
+    if isinstance(value, str):
+        return value
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _reset_after_fork():
+    # Each worker reports only what it handled itself
+    global _last_flush
+    _last_flush = 0.0
+    for metric in _registry:
+        metric._lock = threading.Lock()
+        metric._values = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,125 @@
+"""
+Page Cache - prerendered pages and cached template fragments
+Strategy:
+1. Pages whose only per-user content is the sidebar username (ISS,
+   vision, chat, counselor) are rendered once per path with a placeholder
+   username - at startup via prerender_pages - and served with a string
+   replace instead of a template render
+2. {% cache "name", version %}...{% endcache %} stores a rendered block
+   under (template, name, version). Callers pass a data version such as
+   data_version(events), so new data renders a new entry and stale ones
+   fall out of the LRU
+3. With template auto-reload on (debug), nothing is cached
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, render_template, request, url_for
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import escape
+
+from services.identity_cache import CachedUser
+
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "256"))
+
+USERNAME_MARKER = "__cosmos_username__"
+_PLACEHOLDER_USER = CachedUser(0, USERNAME_MARKER, "")
+
+
+class FragmentCache:
+    """Small LRU of rendered template fragments."""
+
+    def __init__(self, max_size=FRAGMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = FragmentCache()
+# (template, endpoint, script_root) -> page HTML containing USERNAME_MARKER
+_pages = {}
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja tag: {% cache "name", version %}...{% endcache %}"""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [nodes.Const(parser.name), parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        call = self.call_method("_cached_block", [nodes.List(key)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cached_block(self, key, caller):
+        if self.environment.auto_reload:
+            return caller()
+        key = tuple(key)
+        html = fragment_cache.get(key)
+        if html is None:
+            html = caller()
+            fragment_cache.set(key, html)
+        return html
+
+
+def data_version(data):
+    """Short content hash of JSON-serialisable data, for fragment keys."""
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def init_page_cache(app):
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+def _render_with_marker(template):
+    key = (template, request.endpoint, request.script_root)
+    html = _pages.get(key)
+    if html is None:
+        html = _pages[key] = render_template(template, current_user=_PLACEHOLDER_USER)
+    return html
+
+
+def render_page(template):
+    """render_template for pages that only differ per user by the username."""
+    if current_app.jinja_env.auto_reload:
+        return render_template(template)
+    html = _render_with_marker(template)
+    return html.replace(USERNAME_MARKER, str(escape(current_user.username)))
+
+
+def prerender_pages(app, pages):
+    """Render {endpoint: template} pages before the first request."""
+    if app.jinja_env.auto_reload:
+        return
+    for endpoint, template in pages.items():
+        with app.test_request_context():
+            path = url_for(endpoint)
+        with app.test_request_context(path):
+            _render_with_marker(template)
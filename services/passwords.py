@@ -0,0 +1,151 @@
+"""
+Passwords - bounded, offloaded hashing and login throttling
+Strategy:
+1. Hashing and verification run in a small dedicated pool
+   (PASSWORD_HASH_WORKERS); hashlib releases the GIL, so serving threads
+   keep running while a hash is computed
+2. At most PASSWORD_HASH_QUEUE hashes may be pending; beyond that callers
+   get HashingBusy at once instead of queueing behind a login burst; a
+   slot is held until its hash has actually finished, and a hash that
+   takes longer than PASSWORD_HASH_TIMEOUT is reported as HashingBusy too
+3. Cost is set by PASSWORD_HASH_METHOD; hashes made with other settings
+   are flagged by needs_rehash and upgraded on the next good login
+4. LoginThrottle refuses usernames/IPs with too many recent failures
+   before any hash work is done. The client IP comes from ProxyFix
+   (TRUSTED_PROXY_HOPS in app.py). Counters live in each worker process,
+   so with N gunicorn workers the effective limits are up to N times higher
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+
+LOGIN_WINDOW = float(os.getenv("LOGIN_THROTTLE_WINDOW", "900"))
+LOGIN_MAX_FAILURES_USER = int(os.getenv("LOGIN_MAX_FAILURES_USER", "5"))
+LOGIN_MAX_FAILURES_IP = int(os.getenv("LOGIN_MAX_FAILURES_IP", "20"))
+
+
+class HashingBusy(RuntimeError):
+    """Too many password hashes already pending (or one timed out)."""
+
+
+_executor = None
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+_lock = threading.Lock()
+_current_prefix = None
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="cosmos-hash"
+                )
+    return _executor
+
+
+def _run(fn, *args):
+    slots = _slots  # the semaphore is replaced after fork; release this one
+    if not slots.acquire(blocking=False):
+        raise HashingBusy("Password hashing queue is full")
+    try:
+        future = _pool().submit(fn, *args)
+    except BaseException:
+        slots.release()
+        raise
+    # The slot stays taken while the hash is queued or running, even if
+    # this caller stops waiting, so the executor backlog stays bounded
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FuturesTimeoutError:
+        future.cancel()
+        raise HashingBusy("Password hashing timed out")
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """True if password_hash was made with different cost settings."""
+    global _current_prefix
+    if _current_prefix is None:
+        # Werkzeug fills in defaults (e.g. pbkdf2 iterations), so take the
+        # canonical method string from a real hash rather than the setting
+        _current_prefix = generate_password_hash("", PASSWORD_HASH_METHOD).split("$", 1)[0]
+    return password_hash.split("$", 1)[0] != _current_prefix
+
+
+class LoginThrottle:
+    """Sliding-window count of failed logins per username and per IP."""
+
+    def __init__(self, window=LOGIN_WINDOW, max_user=LOGIN_MAX_FAILURES_USER, max_ip=LOGIN_MAX_FAILURES_IP):
+        self.window = window
+        self.limits = {"user": max_user, "ip": max_ip}
+        self._failures = {}  # (kind, value) -> recent failure timestamps
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        failures = self._failures.get(key)
+        if failures is None:
+            return None
+        while failures and failures[0] < now - self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return None
+        return failures
+
+    def retry_after(self, username, ip):
+        """Seconds until another attempt is allowed (0 if allowed now)."""
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            for kind, value in (("user", username.lower()), ("ip", ip)):
+                failures = self._recent((kind, value), now)
+                if failures and len(failures) >= self.limits[kind]:
+                    wait = max(wait, failures[0] + self.window - now)
+        return wait
+
+    def record_failure(self, username, ip):
+        now = time.monotonic()
+        with self._lock:
+            for key in (("user", username.lower()), ("ip", ip)):
+                failures = self._failures.get(key)
+                if failures is None:
+                    # Only the newest `limit` failures matter for the check
+                    failures = self._failures[key] = deque(maxlen=self.limits[key[0]])
+                failures.append(now)
+
+    def reset(self, username):
+        with self._lock:
+            self._failures.pop(("user", username.lower()), None)
+
+
+login_throttle = LoginThrottle()
+
+
+def _reset_after_fork():
+    global _executor, _slots, _lock
+    _executor = None
+    _slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
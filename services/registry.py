@@ -0,0 +1,35 @@
+"""
+Service Registry - per-worker services for the app factory
+Read-only data (catalogues, compiled templates) is loaded once in the
+gunicorn master and shared copy-on-write after fork. Anything holding
+sockets, threads or file handles is built lazily inside each worker and
+discarded in a forked child so it is never shared across processes.
+"""
+import os
+import threading
+
+
+class ServiceRegistry:
+    """Lazily-built, per-process service instances."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._services = {}
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset)
+
+    def get(self, name, factory):
+        """Return the service called name, building it with factory() once."""
+        service = self._services.get(name)
+        if service is None:
+            with self._lock:
+                service = self._services.get(name)
+                if service is None:
+                    service = self._services[name] = factory()
+        return service
+
+    def reset(self):
+        """Forget every service (runs in the child after fork)."""
+        # The parent's lock may have been held mid-fork; start with a new one
+        self._lock = threading.Lock()
+        self._services = {}
@@ -0,0 +1,102 @@
+"""
+Resilience - circuit breakers and latency budgets for provider calls
+Strategy:
+1. Each provider has a breaker fed by a rolling window of outcomes;
+   errors and slow calls both count against it
+2. CLOSED -> OPEN when the bad-call rate crosses the threshold
+3. OPEN -> HALF_OPEN after a cooldown; one probe decides whether to close
+4. Every endpoint call carries a Deadline that each attempt subtracts from
+"""
+import os
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Per-provider breaker over a rolling time window."""
+
+    def __init__(self, name, window=None, min_calls=None, error_rate=None, slow_call=None, cooldown=None):
+        self.name = name
+        self.window = window or float(os.getenv("BREAKER_WINDOW", "60"))
+        self.min_calls = min_calls or int(os.getenv("BREAKER_MIN_CALLS", "5"))
+        self.error_rate = error_rate or float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+        self.slow_call = slow_call or float(os.getenv("BREAKER_SLOW_CALL", "10"))
+        self.cooldown = cooldown or float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._outcomes = deque()  # (timestamp, bad)
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go to the provider right now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+                print(f"[BREAKER] {self.name} half-open, sending probe")
+            # HALF_OPEN: exactly one probe at a time
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def release_probe(self):
+        """End a half-open probe without an outcome (e.g. a per-key quota error)."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def record(self, ok, latency=0.0):
+        """Record one call outcome. Slow successes count as bad calls."""
+        bad = not ok or latency > self.slow_call
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if bad:
+                    self._open(now)
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    print(f"[BREAKER] {self.name} closed")
+                return
+
+            self._outcomes.append((now, bad))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+
+            total = len(self._outcomes)
+            failures = sum(1 for _, b in self._outcomes if b)
+            if self.state == CLOSED and total >= self.min_calls and failures / total >= self.error_rate:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        print(f"[BREAKER] {self.name} open for {self.cooldown:.0f}s")
+
+
+class Deadline:
+    """Total latency budget for one endpoint call."""
+
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def timeout(self, cap):
+        """Timeout for the next attempt: what is left, but at most cap."""
+        return min(self.remaining(), cap)
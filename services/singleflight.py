@@ -0,0 +1,191 @@
+"""
+Single-Flight - share one provider call between identical concurrent requests
+Strategy:
+1. Within a process, callers with the same key wait on the first caller
+2. Across gunicorn workers, the first caller takes a lease row in SQLite;
+   other workers poll that row and reuse the stored result. The lease
+   lasts at least as long as the caller's latency budget, and only the
+   lease owner may store a result in it
+3. Results linger for a couple of seconds so late followers still find them
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS flights (
+    key TEXT PRIMARY KEY,
+    owner INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    result TEXT,
+    finished REAL
+)
+"""
+
+# Slack on top of a caller's budget for the last attempt to wind down
+LEASE_MARGIN = 5
+
+
+def flight_key(prompt, image_b64=None):
+    """Key for a provider call: normalised prompt plus image hash(es)."""
+    digest = hashlib.sha256(" ".join(prompt.split()).casefold().encode())
+    frames = image_b64 if isinstance(image_b64, list) else [image_b64] if image_b64 else []
+    for frame in frames:
+        digest.update(hashlib.sha256(frame.encode()).digest())
+    return digest.hexdigest()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key."""
+
+    def __init__(self, db_path=None, lease_seconds=None, linger_seconds=None, poll_interval=0.05):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds or float(os.getenv("SINGLEFLIGHT_LEASE", "30"))
+        self.linger_seconds = linger_seconds or float(os.getenv("SINGLEFLIGHT_LINGER", "2"))
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._calls = {}
+
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def do(self, key, fn, lease_seconds=None):
+        """Return fn(), sharing the result with concurrent callers of key.
+
+        lease_seconds: how long fn may run (e.g. the latency budget) before
+        another worker may take the key over; a margin is added, and the
+        lease is never shorter than the default.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            lease = max(self.lease_seconds, (lease_seconds or 0) + LEASE_MARGIN)
+            call.result = self._do_shared(key, fn, lease) if self.db_path else fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def _do_shared(self, key, fn, lease_seconds):
+        """Cross-process half: lease the key in SQLite or follow its owner."""
+        try:
+            state, value = self._acquire(key, lease_seconds)
+        except sqlite3.Error as e:
+            # A broken lease store must never block the actual call
+            print(f"[SINGLEFLIGHT] Lease store unavailable: {e}")
+            return fn()
+
+        if state == "done":
+            return value
+        if state == "follow":
+            result = self._follow(key, value)
+            if result is not None:
+                return result
+            # Owner died or failed without a result; do the work ourselves
+            return fn()
+
+        try:
+            result = fn()
+        except Exception:
+            self._release(key)
+            raise
+        self._store(key, result)
+        return result
+
+    def _acquire(self, key, lease_seconds):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "DELETE FROM flights WHERE (finished IS NULL AND expires < ?) OR finished < ?",
+                (now, now - self.linger_seconds),
+            )
+            row = conn.execute(
+                "SELECT result, expires FROM flights WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO flights (key, owner, expires) VALUES (?, ?, ?)",
+                    (key, os.getpid(), now + lease_seconds),
+                )
+                conn.execute("COMMIT")
+                return "lead", None
+            conn.execute("COMMIT")
+
+        result, expires = row
+        if result is not None:
+            return "done", json.loads(result)
+        return "follow", expires
+
+    def _follow(self, key, expires):
+        """Poll the owner's row until it has a result or the lease runs out."""
+        while time.time() < expires:
+            time.sleep(self.poll_interval)
+            try:
+                with self._connect() as conn:
+                    row = conn.execute("SELECT result FROM flights WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error:
+                return None
+            if row is None:
+                return None
+            if row[0] is not None:
+                return json.loads(row[0])
+        return None
+
+    def _store(self, key, result):
+        try:
+            with self._connect() as conn:
+                # If the lease expired and another worker took the key over,
+                # the row is theirs now; leave it alone
+                conn.execute(
+                    "UPDATE flights SET result = ?, finished = ? WHERE key = ? AND owner = ?",
+                    (json.dumps(result), time.time(), key, os.getpid()),
+                )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"[SINGLEFLIGHT] Could not share result: {e}")
+            self._release(key)
+
+    def _release(self, key):
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM flights WHERE key = ? AND owner = ?", (key, os.getpid()))
+        except sqlite3.Error:
+            pass
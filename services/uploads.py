@@ -0,0 +1,80 @@
+"""
+Upload Guard - bounded-memory handling of image uploads
+Strategy:
+1. Request bodies above MAX_UPLOAD_BYTES are refused by Flask (413)
+2. File parts are spooled to a temp file past UPLOAD_SPOOL_BYTES
+3. Only the image header is read to check format and pixel count
+4. Huge JPEGs are decoded at reduced resolution (DCT scaling)
+"""
+import os
+import tempfile
+import warnings
+from flask import Request
+from PIL import Image
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(512 * 1024)))
+
+# Pixels we are willing to hold decoded in memory for one frame
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+# JPEG draft mode can scale by up to 1/8 per side while decoding
+JPEG_DRAFT_FACTOR = 64
+
+ALLOWED_FORMATS = {"JPEG", "MPO", "PNG", "TIFF", "WEBP", "BMP"}
+
+# Pillow's own bomb check runs in Image.open; keep it as a backstop above
+# the largest header we could still accept via draft decoding.
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS * JPEG_DRAFT_FACTOR // 2
+
+
+class UploadError(ValueError):
+    """Upload rejected before decoding; status is the HTTP code to return."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class SpooledRequest(Request):
+    """Request whose file parts spool to disk past UPLOAD_SPOOL_BYTES.
+
+    The body size cap itself comes from app.config['MAX_CONTENT_LENGTH'].
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="rb+")
+
+
+def open_image(image_file, max_size=1024):
+    """
+    Open an image lazily and validate it from the header alone.
+    Returns the unloaded PIL image, already in draft mode for JPEGs so
+    that decoding produces at most ~max_size pixels per side.
+    Raises UploadError for unsupported formats or oversize images.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            img = Image.open(image_file)
+    except Image.DecompressionBombError:
+        raise UploadError("Image dimensions too large", status=413)
+    except Exception:
+        raise UploadError("Unrecognised image file")
+
+    if img.format not in ALLOWED_FORMATS:
+        raise UploadError(f"Unsupported image format: {img.format}")
+
+    if img.format in ("JPEG", "MPO"):
+        # Picks the largest DCT scale that still covers max_size
+        img.draft("RGB", (max_size, max_size))
+
+    width, height = img.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise UploadError(f"Image too large ({width}x{height})", status=413)
+    return img
+
+
+def inspect_upload(image_file):
+    """Validate an upload's header, then rewind it for the real decode."""
+    open_image(image_file)
+    image_file.seek(0)
@@ -1,17 +1,24 @@
-from PIL import Image
+from PIL import Image, ImageStat
+from concurrent.futures import ThreadPoolExecutor
 import io
+import os
 import base64
+import zipfile
+from services.metrics import timed
+from services.uploads import MAX_UPLOAD_BYTES, UploadError, open_image
 
+@timed("compress_image")
 def compress_image(image_file, max_size=1024):
     """
     Compress image to max 1024px and return base64 string.
     image_file: FileStorage object from Flask or bytes.
     """
     try:
-        img = Image.open(image_file)
+        # Header is validated first; huge JPEGs decode at reduced resolution
+        img = open_image(image_file, max_size)
         
-        # Convert to RGB if RGBA (to save as JPEG)
-        if img.mode == 'RGBA':
+        # Convert to RGB if RGBA, palette, CMYK... (to save as JPEG)
+        if img.mode not in ('RGB', 'L'):
             img = img.convert('RGB')
             
         # Resize if larger than max_size
@@ -29,3 +36,60 @@ def compress_image(image_file, max_size=1024):
     except Exception as e:
         print(f"Error compressing image: {e}")
         return None
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp', '.bmp')
+
+# Total uncompressed bytes accepted from one zip upload
+MAX_ARCHIVE_BYTES = int(os.getenv("MAX_ARCHIVE_BYTES", str(4 * MAX_UPLOAD_BYTES)))
+
+
+def compress_images(image_files, max_size=1024, workers=None):
+    """
+    Compress many images in parallel (Pillow releases the GIL while
+    decoding and resizing). Returns base64 strings in input order,
+    with None for frames that failed.
+    """
+    workers = workers or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda f: compress_image(f, max_size), image_files))
+
+
+def iter_zip_images(zip_file, max_members=None):
+    """
+    Yield (name, file object) for every image inside a zip upload.
+    zip_file: seekable file object (Flask spools uploads to disk).
+    Member count (max_members) and sizes are checked from the central
+    directory before anything is inflated, so oversized archives and zip
+    bombs are rejected up front.
+    """
+    with zipfile.ZipFile(zip_file) as archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        if max_members is not None and len(members) > max_members:
+            raise UploadError(f"Too many images in archive ({len(members)}, at most {max_members} allowed)")
+        if sum(info.file_size for info in members) > MAX_ARCHIVE_BYTES:
+            raise UploadError("Archive too large when extracted", status=413)
+        for info in members:
+            if info.file_size > MAX_UPLOAD_BYTES:
+                raise UploadError(f"{info.filename} is too large", status=413)
+            # zipfile never inflates past the declared file_size
+            yield info.filename, io.BytesIO(archive.read(info))
+
+
+def image_stats(image_b64):
+    """
+    Brightness statistics for one compressed frame, computed with Pillow's
+    C histogram instead of a Python loop over pixels.
+    """
+    img = Image.open(io.BytesIO(base64.b64decode(image_b64))).convert('RGB')
+    # Channel average, i.e. (r+g+b)/3 per pixel
+    gray = img.convert('L', matrix=(1/3, 1/3, 1/3, 0))
+    histogram = gray.histogram()
+    return {
+        "avg_brightness": sum(ImageStat.Stat(img).mean) / 3,
+        "bright_spots": sum(histogram[201:]),
+        "num_pixels": img.width * img.height,
+    }
@@ -206,6 +206,27 @@ function previewImage() {
     }
 }
 
+// Background Jobs - poll with backoff until the job finishes
+// Each poll returns at once; the gap grows from 0.5s to 5s between polls.
+// Give up a little after the server-side job timeout (JOB_TIMEOUT, 300s)
+const JOB_MAX_WAIT_MS = 330000;
+const JOB_POLL_MIN_MS = 500;
+const JOB_POLL_MAX_MS = 5000;
+
+async function waitForJob(pollUrl) {
+    const deadline = Date.now() + JOB_MAX_WAIT_MS;
+    let delay = JOB_POLL_MIN_MS;
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        delay = Math.min(delay * 2, JOB_POLL_MAX_MS);
+        const response = await fetch(pollUrl);
+        const job = await response.json();
+        if (job.status === 'done') return job.result;
+        if (job.status === 'failed' || job.error) return { error: job.error || 'Analysis failed' };
+    }
+    return { error: 'Analysis is taking too long, please try again' };
+}
+
 // Sky Image Analyzer
 async function analyzeImage(input) {
     if (!checkCooldown()) return;
@@ -217,6 +238,7 @@ async function analyzeImage(input) {
 
     const formData = new FormData();
     formData.append('image', file);
+    formData.append('mode', 'async');
 
     const resultDiv = document.getElementById('vision-result');
     const btn = document.getElementById('analyze-btn');
@@ -229,7 +251,8 @@ async function analyzeImage(input) {
             method: 'POST',
             body: formData
         });
-        const data = await response.json();
+        let data = await response.json();
+        if (response.status === 202) data = await waitForJob(data.poll_url);
 
         if (data.error) {
             resultDiv.innerHTML = `